@@ -0,0 +1,28 @@
+"""add posts created_at id index
+
+Revision ID: 5b1d7c3e9a20
+Revises: cf4a0628e2cb
+Create Date: 2026-10-18 09:12:41.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b1d7c3e9a20'
+down_revision: Union[str, None] = 'cf4a0628e2cb'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_posts_created_at_id', 'posts', ['created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_posts_created_at_id', table_name='posts')
@@ -0,0 +1,34 @@
+"""add posts vote_count
+
+Revision ID: 8e4f2a6c1d73
+Revises: 5b1d7c3e9a20
+Create Date: 2026-10-18 11:40:02.573119
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8e4f2a6c1d73'
+down_revision: Union[str, None] = '5b1d7c3e9a20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('posts', sa.Column('vote_count', sa.Integer(), server_default='0', nullable=False))
+    # backfill from the votes that already exist
+    op.execute(
+        "UPDATE posts SET vote_count = counted.votes "
+        "FROM (SELECT post_id, count(*) AS votes FROM votes GROUP BY post_id) AS counted "
+        "WHERE posts.id = counted.post_id"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('posts', 'vote_count')
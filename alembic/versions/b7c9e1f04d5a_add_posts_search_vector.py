@@ -0,0 +1,34 @@
+"""add posts search_vector
+
+Revision ID: b7c9e1f04d5a
+Revises: 8e4f2a6c1d73
+Create Date: 2026-10-18 13:05:27.904316
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7c9e1f04d5a'
+down_revision: Union[str, None] = '8e4f2a6c1d73'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # a stored generated column is filled for the existing rows while the table is rewritten
+    op.add_column('posts', sa.Column('search_vector', postgresql.TSVECTOR(), sa.Computed(
+        "setweight(to_tsvector('simple', title), 'A') || setweight(to_tsvector('simple', content), 'B')",
+        persisted=True), nullable=True))
+    op.create_index('ix_posts_search_vector', 'posts', ['search_vector'], unique=False, postgresql_using='gin')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_posts_search_vector', table_name='posts', postgresql_using='gin')
+    op.drop_column('posts', 'search_vector')
@@ -0,0 +1,30 @@
+"""add posts updated_at
+
+Revision ID: d41a6b8f2c97
+Revises: b7c9e1f04d5a
+Create Date: 2026-10-18 15:12:44.208391
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd41a6b8f2c97'
+down_revision: Union[str, None] = 'b7c9e1f04d5a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('posts', sa.Column('updated_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False))
+    # existing posts were last modified when they were created
+    op.execute("UPDATE posts SET updated_at = created_at")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('posts', 'updated_at')
@@ -0,0 +1,340 @@
+import pickle
+import time
+from collections import OrderedDict
+from threading import Lock, RLock
+from typing import Any, Callable, Hashable, Iterable, NamedTuple, Optional
+
+from app import metrics
+from app.config import settings
+
+
+class TTLCache:
+    """
+    In-process LRU cache whose entries expire after `ttl` seconds.
+
+    `set` accepts a per-entry ttl for values that know their own lifetime.
+    Hits and misses are counted on the instance and exported as
+    `cache_requests_total{cache=name}`. `on_evict(key)` is called, outside the
+    cache's lock, for each entry dropped because it expired or fell off the LRU end.
+    """
+
+    def __init__(self, name: str, maxsize: int = 1024, ttl: float = 60.0,
+                 on_evict: Optional[Callable[[Hashable], None]] = None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        expired = False
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._data[key]
+                entry = None
+                expired = True
+            if entry is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+                metrics.CACHE_REQUESTS.labels(self.name, "hit").inc()
+                return entry[1]
+            self.misses += 1
+            metrics.CACHE_REQUESTS.labels(self.name, "miss").inc()
+        if expired and self.on_evict is not None:
+            self.on_evict(key)
+        return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        evicted = []
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                evicted.append(self._data.popitem(last=False)[0])
+        if self.on_evict is not None:
+            for key in evicted:
+                self.on_evict(key)
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+# ---------------------------------------------------------------- response cache
+
+POSTS_LIST_TAG = "posts:list"
+POSTS_SEARCH_TAG = "posts:search"
+
+
+def post_tag(post_id: int) -> str:
+    """Tag of every cached response that shows post `post_id`."""
+    return f"post:{post_id}"
+
+
+class CacheEntry(NamedTuple):
+    value: Any
+    # wall clock time, so that every worker agrees on an entry's age
+    stored_at: float
+
+    @property
+    def age(self) -> float:
+        return max(0.0, time.time() - self.stored_at)
+
+
+class CacheBackend:
+    """
+    Store of the response cache. Entries carry tags, and invalidating a tag drops
+    every entry carrying it: a write only evicts the responses it can have changed.
+
+    A response read while a write commits may predate it, yet be stored after the
+    write invalidated its tags. Take `version()` before reading and pass it to
+    `set`, which then drops the entry if anything was invalidated in between.
+    """
+
+    name = "response"
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        raise NotImplementedError
+
+    def version(self) -> Any:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any, tags: Iterable[str] = (), ttl: Optional[float] = None, version: Any = None):
+        raise NotImplementedError
+
+    def invalidate_tags(self, *tags: str):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def _count(self, entry: Optional[CacheEntry]) -> Optional[CacheEntry]:
+        metrics.CACHE_REQUESTS.labels(self.name, "miss" if entry is None else "hit").inc()
+        if entry is not None:
+            metrics.CACHE_HIT_AGE_SECONDS.labels(self.name).observe(entry.age)
+        return entry
+
+
+class NullCacheBackend(CacheBackend):
+    """RESPONSE_CACHE_BACKEND=none"""
+
+    def get(self, key):
+        return None
+
+    def version(self):
+        return None
+
+    def set(self, key, value, tags=(), ttl=None, version=None):
+        pass
+
+    def invalidate_tags(self, *tags):
+        pass
+
+    def clear(self):
+        pass
+
+
+class LocalCacheBackend(CacheBackend):
+    """
+    LRU + TTL inside the worker process. Other workers do not see its invalidations,
+    so with several workers a write can stay invisible there for up to `ttl` seconds.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 30.0):
+        # hits and misses are counted here, with age, not by the TTLCache
+        self._entries = TTLCache("response_entries", maxsize=maxsize, ttl=ttl, on_evict=self._forget)
+        # both ways, so that an entry gone from _entries leaves its tags too
+        self._keys_by_tag: dict[str, set[str]] = {}
+        self._tags_by_key: dict[str, tuple[str, ...]] = {}
+        # invalidations so far, the version
+        self._writes = 0
+        # reentrant: storing an entry can evict another one, whose tags are then forgotten
+        self._lock = RLock()
+
+    def get(self, key):
+        return self._count(self._entries.get(key))
+
+    def version(self):
+        return self._writes
+
+    def set(self, key, value, tags=(), ttl=None, version=None):
+        with self._lock:
+            if (version is not None and version != self._writes) or self._entries.maxsize <= 0:
+                return
+            # an overwritten entry may have had other tags
+            self._forget(key)
+            self._entries.set(key, CacheEntry(value, time.time()), ttl=ttl)
+            self._tags_by_key[key] = tuple(tags)
+            for tag in self._tags_by_key[key]:
+                self._keys_by_tag.setdefault(tag, set()).add(key)
+
+    def _forget(self, key):
+        with self._lock:
+            for tag in self._tags_by_key.pop(key, ()):
+                keys = self._keys_by_tag.get(tag)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._keys_by_tag[tag]
+
+    def invalidate_tags(self, *tags):
+        with self._lock:
+            self._writes += 1
+            keys = set().union(*(self._keys_by_tag.pop(tag, ()) for tag in tags))
+            for key in keys:
+                self._forget(key)
+                self._entries.delete(key)
+
+    def clear(self):
+        self._entries.clear()
+        with self._lock:
+            self._keys_by_tag.clear()
+            self._tags_by_key.clear()
+
+
+class KeyValueStore:
+    """The few commands SharedCacheBackend and the shared rate limiter need from a shared store such as redis."""
+
+    def get_many(self, keys: list[str]) -> list[Optional[bytes]]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, ttl: float):
+        raise NotImplementedError
+
+    def incr(self, key: str) -> int:
+        raise NotImplementedError
+
+    def compare_and_set(self, key: str, expected: Optional[bytes], value: bytes, ttl: float) -> bool:
+        """Set `key` only if it still holds `expected` (None: is missing), e.g. WATCH/MULTI or a script on redis."""
+        raise NotImplementedError
+
+    def flush(self):
+        raise NotImplementedError
+
+
+class InMemoryKeyValueStore(KeyValueStore):
+    """Local stand-in for the shared store; backends built on one instance behave like workers sharing redis."""
+
+    def __init__(self):
+        self._data: dict[str, tuple[float, bytes]] = {}
+        self._lock = Lock()
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        with self._lock:
+            values = [self._data.get(key) for key in keys]
+        return [None if value is None or value[0] <= now else value[1] for value in values]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+
+    def incr(self, key):
+        with self._lock:
+            _, value = self._data.get(key, (float("inf"), b"0"))
+            value = str(int(value) + 1).encode()
+            self._data[key] = (float("inf"), value)
+            return int(value)
+
+    def compare_and_set(self, key, expected, value, ttl):
+        with self._lock:
+            current = self._data.get(key)
+            if current is not None and current[0] <= time.monotonic():
+                current = None
+            if (current[1] if current else None) != expected:
+                return False
+            self._data[key] = (time.monotonic() + ttl, value)
+            return True
+
+    def flush(self):
+        with self._lock:
+            self._data.clear()
+
+
+class SharedCacheBackend(CacheBackend):
+    """
+    Response cache in a store shared by all workers. Tags are generation counters:
+    an entry remembers the generation of its tags when stored and is ignored once
+    any of them moved on, so invalidation is a single INCR per tag. One more
+    counter of all invalidations is the version.
+    """
+
+    def __init__(self, store: KeyValueStore, ttl: float = 30.0, prefix: str = "fastapi:cache:"):
+        self.store = store
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _tag_keys(self, tags):
+        return [f"{self.prefix}tag:{tag}" for tag in tags]
+
+    @property
+    def _writes_key(self):
+        return f"{self.prefix}writes"
+
+    def get(self, key):
+        raw = self.store.get_many([self.prefix + key])[0]
+        if raw is None:
+            return self._count(None)
+        generations, entry = pickle.loads(raw)
+        current = self.store.get_many(self._tag_keys(generations)) if generations else []
+        if any((value or b"0") != generation for value, generation in zip(current, generations.values())):
+            return self._count(None)
+        return self._count(entry)
+
+    def version(self):
+        return self.store.get_many([self._writes_key])[0] or b"0"
+
+    def set(self, key, value, tags=(), ttl=None, version=None):
+        tags = list(tags)
+        writes, *current = self.store.get_many([self._writes_key, *self._tag_keys(tags)])
+        if version is not None and (writes or b"0") != version:
+            return
+        # an invalidation from here on moves one of these generations, so the entry is ignored
+        generations = dict(zip(tags, (value or b"0" for value in current)))
+        raw = pickle.dumps((generations, CacheEntry(value, time.time())))
+        self.store.set(self.prefix + key, raw, self.ttl if ttl is None else ttl)
+
+    def invalidate_tags(self, *tags):
+        # the version first: a set that still sees the old version reads the old generations
+        self.store.incr(self._writes_key)
+        for tag_key in self._tag_keys(tags):
+            self.store.incr(tag_key)
+
+    def clear(self):
+        self.store.flush()
+
+
+def create_response_cache() -> CacheBackend:
+    backend = settings.RESPONSE_CACHE_BACKEND
+    if backend == "none":
+        return NullCacheBackend()
+    if backend == "local":
+        return LocalCacheBackend(maxsize=settings.RESPONSE_CACHE_SIZE, ttl=settings.RESPONSE_CACHE_TTL)
+    if backend == "shared":
+        # swap the stand-in for a redis-backed KeyValueStore to share one cache between workers
+        return SharedCacheBackend(InMemoryKeyValueStore(), ttl=settings.RESPONSE_CACHE_TTL)
+    raise ValueError(f"Unknown response cache backend {backend!r}, expected 'none', 'local' or 'shared'")
+
+
+response_cache = create_response_cache()
@@ -0,0 +1,73 @@
+"""
+Validators for conditional GETs: the handlers send an `ETag` (and `Last-Modified`
+where the row has one) and answer a matching `If-None-Match` / `If-Modified-Since`
+with a bodiless 304.
+"""
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+
+from fastapi import Request, Response, status
+
+
+def post_etag(post_id: int, updated_at: datetime, vote_count: int, has_voted: bool = False) -> str:
+    # updated_at moves on every edit and vote, vote_count is there for writes made within one transaction;
+    # has_voted differs between viewers of the same version
+    return f'"p{post_id}.{int(updated_at.timestamp() * 1_000_000)}.{vote_count}{".v" if has_voted else ""}"'
+
+
+def user_etag(user_id: int, created_at: datetime) -> str:
+    # users are never updated
+    return f'"u{user_id}.{int(created_at.timestamp() * 1_000_000)}"'
+
+
+def content_etag(content: bytes) -> str:
+    """For responses without a single row version, e.g. a page of posts."""
+    return f'"{hashlib.blake2b(content, digest_size=16).hexdigest()}"'
+
+
+def http_date(value: datetime) -> str:
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+
+def validators(etag: str, last_modified: Optional[datetime] = None) -> dict:
+    headers = {"ETag": etag}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+
+def is_conditional(request: Request) -> bool:
+    return "if-none-match" in request.headers or "if-modified-since" in request.headers
+
+
+def not_modified(request: Request, headers: dict) -> bool:
+    """
+    Whether the response with validator `headers` (see validators()) can be a 304.
+    RFC 9110 section 13.2.2: If-None-Match wins when both are sent and uses the
+    weak comparison, so `W/"x"` matches `"x"`. If-Modified-Since has one second
+    resolution, like Last-Modified itself.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        etag = headers.get("ETag", "").removeprefix("W/")
+        return etag != "" and etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None or "Last-Modified" not in headers:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        # an unparsable date is ignored
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return parsedate_to_datetime(headers["Last-Modified"]) <= since
+
+
+def not_modified_response(headers: dict) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
@@ -7,12 +7,110 @@ class Settings(BaseSettings):
     DATABASE_PASSWORD: str
     DATABASE_NAME: str
     DATABASE_USERNAME: str
+    # per engine and per worker: keep
+    # gunicorn workers * (DATABASE_POOL_SIZE + DATABASE_MAX_OVERFLOW) below postgres max_connections
+    DATABASE_POOL_SIZE: int = 5
+    DATABASE_MAX_OVERFLOW: int = 5
+    # seconds a request waits for a free connection before it fails
+    DATABASE_POOL_TIMEOUT: float = 10
+    # seconds after which a connection is replaced, and a liveness check on checkout,
+    # so connections killed by a postgres restart are never handed out
+    DATABASE_POOL_RECYCLE: int = 1800
+    DATABASE_POOL_PRE_PING: bool = True
+    # behind PgBouncer in transaction mode: no pool of our own and no prepared statements
+    DATABASE_PGBOUNCER: bool = False
+    # compiled statements SQLAlchemy keeps per engine, and statements asyncpg
+    # prepares per connection (the latter is forced to 0 behind PgBouncer)
+    DATABASE_QUERY_CACHE_SIZE: int = 500
+    DATABASE_PREPARED_STATEMENT_CACHE_SIZE: int = 100
+    # comma separated postgresql+asyncpg:// urls, GET endpoints read from these
+    DATABASE_REPLICA_URLS: str = ""
+    # "round_robin" or "least_connections"
+    DATABASE_REPLICA_STRATEGY: str = "round_robin"
+    # after a write the user reads from the primary for this many seconds
+    DATABASE_READ_YOUR_WRITES_SECONDS: float = 5
     SECRET_KEY: str
     ALGORITHM: str
     ACCESS_TOKEN_EXPIRE_MINUTES: int
 
+    # bcrypt runs outside the event loop, in a "thread" or "process" pool
+    PASSWORD_HASH_POOL: str = "thread"
+    PASSWORD_HASH_WORKERS: int = 4
+    # jobs allowed to wait for a free worker before we answer 503
+    PASSWORD_HASH_QUEUE_SIZE: int = 32
+    PASSWORD_HASH_RETRY_AFTER: int = 1
+
+    # authenticated users are cached by id for PRINCIPAL_CACHE_TTL seconds
+    PRINCIPAL_CACHE_SIZE: int = 10000
+    PRINCIPAL_CACHE_TTL: int = 60
+    # verified access tokens are remembered until their exp claim
+    TOKEN_CACHE_SIZE: int = 10000
+    # put the UserResponse fields in the access token, so that
+    # get_current_user never needs the users table
+    EMBED_USER_CLAIMS: bool = False
+
+    # GET /posts builds its json straight from Core rows, skipping ORM objects and pydantic
+    POSTS_ROW_SERIALIZATION: bool = False
+
+    # cache of GET /posts and GET /posts/{id} responses: "none", "local" (per worker) or "shared".
+    # Off by default: a write only invalidates the cache of the worker that took it, and
+    # "shared" still runs on an in-process stand-in until a redis store is plugged in, so
+    # with several workers both serve pages up to RESPONSE_CACHE_TTL stale, the author's
+    # own writes included. "local" is for a single worker
+    RESPONSE_CACHE_BACKEND: str = "none"
+    RESPONSE_CACHE_SIZE: int = 1024
+    # also the longest a local cache can be stale for writes made on another worker
+    RESPONSE_CACHE_TTL: float = 30
+
+    # coalesce concurrent votes into one write of up to VOTE_BATCH_SIZE votes,
+    # holding each for at most VOTE_BATCH_DELAY_MS
+    VOTE_BATCHING: bool = False
+    VOTE_BATCH_SIZE: int = 100
+    VOTE_BATCH_DELAY_MS: float = 10
+
+    # most items accepted by one request to the bulk endpoints
+    BULK_MAX_ITEMS: int = 1000
+
+    # rows fetched from the server-side cursor, and sent, per chunk of GET /posts/export
+    EXPORT_CHUNK_SIZE: int = 1000
+
+    # level of the app's json logs; DEBUG also logs who calls the post and user endpoints
+    LOG_LEVEL: str = "INFO"
+    # statements slower than this are logged, with their parameter values redacted
+    SLOW_QUERY_MS: float = 200
+    # Server-Timing response header with the time spent in the app and in the database
+    SERVER_TIMING: bool = True
+
+    # token buckets: "10/minute" allows a burst of 10, then one request every 6 seconds
+    RATE_LIMIT_ENABLED: bool = True
+    # "local" (per worker) or "shared"
+    RATE_LIMIT_BACKEND: str = "local"
+    # per client IP
+    RATE_LIMIT_LOGIN: str = "10/minute"
+    RATE_LIMIT_SIGNUP: str = "5/minute"
+    # per user
+    RATE_LIMIT_VOTE: str = "120/minute"
+    # take the client IP from the X-Real-IP header nginx sets; turn off when not behind nginx
+    RATE_LIMIT_TRUST_X_REAL_IP: bool = True
+
+    # live vote counts over /live/ws and /live/posts: "local" only reaches the
+    # connections of the worker that took the vote
+    LIVE_BACKEND: str = "local"
+    # posts a connection may watch, and posts with updates it may fall behind on
+    LIVE_MAX_POSTS: int = 100
+    LIVE_QUEUE_SIZE: int = 100
+    # idle seconds before an SSE comment line, and the reconnect delay sent to EventSource
+    LIVE_HEARTBEAT_SECONDS: float = 15
+    LIVE_SSE_RETRY_MS: int = 3000
+
+    # GET /posts/top and /posts/trending rank an in-memory index that votes keep current;
+    # it is rebuilt from the table in the background once older than this
+    FEED_REFRESH_SECONDS: float = 300
+    # trending: a post needs 10x the votes to outrank one posted this many seconds later
+    FEED_TRENDING_DECAY_SECONDS: float = 45000
+
     class Config:
         env_file = ".env"
 
 
-settings = Settings()
\ No newline at end of file
+settings = Settings()
@@ -1,19 +1,92 @@
-from sqlalchemy import create_engine
+import time
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
+from app import metrics
 from app.config import settings
+from app.instrumentation import instrument_engine
+
+
+SQLALCHEMY_DATABASE_URL = f"postgresql+asyncpg://{settings.DATABASE_USERNAME}:{settings.DATABASE_PASSWORD}@{settings.DATABASE_HOSTNAME}:{settings.DATABASE_PORT}/{settings.DATABASE_NAME}"
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool that reports how long checkouts wait and how often they time out."""
+
+    metrics_name = "primary"
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics_name = self.metrics_name
+        return pool
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            metrics.DB_POOL_TIMEOUTS.labels(self.metrics_name).inc()
+            raise
+        finally:
+            metrics.DB_POOL_CHECKOUT_SECONDS.labels(self.metrics_name).observe(time.perf_counter() - start)
+
+
+def report_pool_usage(engine, name: str):
+    capacity = settings.DATABASE_POOL_SIZE + settings.DATABASE_MAX_OVERFLOW
+
+    def update(returning: int):
+        # looked up every time: dispose() swaps in a new pool
+        checked_out = engine.sync_engine.pool.checkedout() - returning
+        metrics.DB_POOL_CHECKED_OUT.labels(name).set(checked_out)
+        metrics.DB_POOL_SATURATION.labels(name).set(checked_out / capacity)
+
+    # "checkin" fires while the returned connection is still counted as checked out
+    event.listen(engine.sync_engine.pool, "checkout", lambda *args: update(0))
+    event.listen(engine.sync_engine.pool, "checkin", lambda *args: update(1))
+
+
+def create_db_engine(url: str, name: str = "primary"):
+    """Async engine configured from the DATABASE_POOL_* / DATABASE_PGBOUNCER settings."""
+    if settings.DATABASE_PGBOUNCER:
+        # PgBouncer pools for us. In transaction mode a prepared statement may land on
+        # another server connection, so both asyncpg's and SQLAlchemy's caches are off
+        engine = create_async_engine(url, poolclass=NullPool,
+                                     query_cache_size=settings.DATABASE_QUERY_CACHE_SIZE,
+                                     connect_args={"statement_cache_size": 0, "prepared_statement_cache_size": 0})
+        instrument_engine(engine, name)
+        return engine
 
+    engine = create_async_engine(url,
+                                 poolclass=InstrumentedPool,
+                                 pool_size=settings.DATABASE_POOL_SIZE,
+                                 max_overflow=settings.DATABASE_MAX_OVERFLOW,
+                                 pool_timeout=settings.DATABASE_POOL_TIMEOUT,
+                                 pool_recycle=settings.DATABASE_POOL_RECYCLE,
+                                 pool_pre_ping=settings.DATABASE_POOL_PRE_PING,
+                                 query_cache_size=settings.DATABASE_QUERY_CACHE_SIZE,
+                                 connect_args={"prepared_statement_cache_size": settings.DATABASE_PREPARED_STATEMENT_CACHE_SIZE})
+    engine.sync_engine.pool.metrics_name = name
+    report_pool_usage(engine, name)
+    instrument_engine(engine, name)
+    return engine
 
-SQLALCHEMY_DATABASE_URL = f"postgresql://{settings.DATABASE_USERNAME}:{settings.DATABASE_PASSWORD}@{settings.DATABASE_HOSTNAME}:{settings.DATABASE_PORT}/{settings.DATABASE_NAME}"
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# asyncpg keeps the event loop free while postgres works on a query,
+# so one slow query no longer stalls every other request in the worker
+engine = create_db_engine(SQLALCHEMY_DATABASE_URL)
+# expire_on_commit=False: after commit the objects stay readable without
+# another (implicit, and in async forbidden) round trip to the database
+SessionLocal = sessionmaker(engine, class_=AsyncSession, autocommit=False, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
 
-def get_db():
+async def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        await db.close()
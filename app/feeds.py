@@ -0,0 +1,170 @@
+"""
+Ranked feeds of posts, kept in memory instead of sorted by the database on
+every request.
+
+The index is built from one scan of (id, created_at, vote_count) and then kept
+up to date by the vote updates of the live hub, so a vote moves its post at
+once. A full rebuild every FEED_REFRESH_SECONDS picks up what the updates do
+not carry: posts created or deleted on other workers, and votes on other
+workers while the hub backend is local.
+
+"top" ranks by votes. "trending" uses the reddit "hot" score: log10(votes)
+plus the post's age in units of FEED_TRENDING_DECAY_SECONDS, so a post needs
+ten times the votes to outrank one that is that much newer. That score does
+not change with the clock, only with votes, which is what lets the sorted
+index be updated one post at a time rather than re-sorted.
+"""
+
+import asyncio
+import logging
+import math
+import time
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime
+from typing import Callable, Optional
+
+import orjson
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import models
+from app.config import settings
+from app.database import SessionLocal
+from app.live import hub
+
+logger = logging.getLogger(__name__)
+
+
+def top_score(created_at: float, vote_count: int) -> float:
+    return float(vote_count)
+
+
+def trending_score(created_at: float, vote_count: int) -> float:
+    order = math.log10(max(abs(vote_count), 1))
+    sign = 1 if vote_count > 0 else -1 if vote_count < 0 else 0
+    return sign * order + created_at / settings.FEED_TRENDING_DECAY_SECONDS
+
+
+class RankedFeed:
+    """Post ids sorted by a score, best first, newest first among equal scores."""
+
+    def __init__(self, score: Callable[[float, int], float]):
+        self.score = score
+        # (-score, -id) ascending is best first
+        self._keys: list[tuple[float, int]] = []
+        self._key_of: dict[int, tuple[float, int]] = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def load(self, posts: dict[int, tuple[float, int]]):
+        self._key_of = {id: (-self.score(*post), -id) for id, post in posts.items()}
+        self._keys = sorted(self._key_of.values())
+
+    def update(self, id: int, created_at: float, vote_count: int):
+        self.remove(id)
+        key = self._key_of[id] = (-self.score(created_at, vote_count), -id)
+        insort(self._keys, key)
+
+    def remove(self, id: int):
+        key = self._key_of.pop(id, None)
+        if key is not None:
+            del self._keys[bisect_left(self._keys, key)]
+
+    def page(self, limit: int, after: Optional[tuple[float, int]] = None) -> list[tuple[float, int]]:
+        """Up to `limit` (score, id) pairs following the pair `after`, the cursor of the previous page."""
+        start = bisect_right(self._keys, (-after[0], -after[1])) if after else 0
+        return [(-score, -id) for score, id in self._keys[start:start + limit]]
+
+
+class FeedIndex:
+    def __init__(self):
+        self.feeds = {"top": RankedFeed(top_score), "trending": RankedFeed(trending_score)}
+        # id -> (created_at as a timestamp, vote_count)
+        self._posts: dict[int, tuple[float, int]] = {}
+        # time.time() of the scan the index was built from, None before the first one
+        self.built_at: Optional[float] = None
+        self._build_lock = asyncio.Lock()
+        self._refresh: Optional[asyncio.Task] = None
+        # changes (method, args) received while a rebuild is scanning, replayed on top of it in order:
+        # the scan's snapshot may predate them
+        self._missed: Optional[list[tuple[Callable, tuple]]] = None
+
+    @property
+    def age(self) -> Optional[float]:
+        return None if self.built_at is None else time.time() - self.built_at
+
+    def reset(self):
+        self.__init__()
+
+    async def rebuild(self, db: AsyncSession):
+        started = time.time()
+        self._missed = []
+        try:
+            result = await db.execute(select(models.Posts.id, models.Posts.created_at, models.Posts.vote_count))
+            posts = {row.id: (row.created_at.timestamp(), row.vote_count) for row in result}
+        except BaseException:
+            self._missed = None
+            raise
+        for feed in self.feeds.values():
+            feed.load(posts)
+        self._posts = posts
+        # built first, or the replayed adds would be ignored
+        self.built_at = started
+        missed, self._missed = self._missed, None
+        for change, args in missed:
+            change(*args)
+        logger.info("feeds rebuilt", extra={"posts": len(posts), "duration_ms": round((time.time() - started) * 1000, 1)})
+
+    async def ensure_fresh(self, db: AsyncSession):
+        """Build the index on first use; past FEED_REFRESH_SECONDS, rebuild it in the background and serve it meanwhile."""
+        if self.built_at is None:
+            async with self._build_lock:
+                if self.built_at is None:
+                    await self.rebuild(db)
+        elif self.age > settings.FEED_REFRESH_SECONDS and (self._refresh is None or self._refresh.done()):
+            self._refresh = asyncio.create_task(self._rebuild_in_background())
+
+    async def _rebuild_in_background(self):
+        # the request's session is closed by then, this one belongs to the task
+        try:
+            async with self._build_lock:
+                async with SessionLocal() as db:
+                    await self.rebuild(db)
+        except Exception:
+            logger.exception("feeds rebuild failed")
+
+    def add(self, id: int, created_at: datetime, vote_count: int = 0):
+        if self._missed is not None:
+            self._missed.append((self.add, (id, created_at, vote_count)))
+        if self.built_at is None:
+            return
+        self._posts[id] = (created_at.timestamp(), vote_count)
+        for feed in self.feeds.values():
+            feed.update(id, *self._posts[id])
+
+    def remove(self, id: int):
+        if self._missed is not None:
+            self._missed.append((self.remove, (id,)))
+        self._posts.pop(id, None)
+        for feed in self.feeds.values():
+            feed.remove(id)
+
+    def set_vote_count(self, id: int, vote_count: int):
+        if self._missed is not None:
+            self._missed.append((self.set_vote_count, (id, vote_count)))
+        post = self._posts.get(id)
+        if post is None:
+            return
+        self._posts[id] = (post[0], vote_count)
+        for feed in self.feeds.values():
+            feed.update(id, post[0], vote_count)
+
+    def on_vote(self, message: bytes):
+        update = orjson.loads(message)
+        if update["vote_count"] is not None:
+            self.set_vote_count(update["post_id"], update["vote_count"])
+
+
+feed_index = FeedIndex()
+hub.backend.subscribe(feed_index.on_vote)
@@ -0,0 +1,144 @@
+"""
+Request timing and database accounting.
+
+instrument_engine() times every statement of an engine and counts its compiled
+cache hits and misses; RequestTimingMiddleware
+adds them up per request into latency / query count histograms, a
+`Server-Timing` header and one log line per request.
+"""
+
+import logging
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import default
+from starlette.datastructures import MutableHeaders
+
+from app import metrics
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+    def server_timing(self, total_seconds: float) -> str:
+        return f'app;dur={total_seconds * 1000:.1f}, db;dur={self.db_seconds * 1000:.1f};desc="{self.queries} queries"'
+
+
+# the stats of the request being served; SQLAlchemy copies the context into the
+# greenlet that runs the engine events, so they see the same object
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def redact(parameters):
+    """Keep the shape of the bound parameters, not their values: they hold emails, password hashes, posts."""
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+# ExecutionContext.cache_hit -> the `result` label of sql_compile_cache_total
+CACHE_RESULTS = {
+    default.CACHE_HIT: "hit",
+    default.CACHE_MISS: "miss",
+    default.CACHING_DISABLED: "disabled",
+    default.NO_CACHE_KEY: "no_key",
+}
+
+
+def cache_result(context) -> str:
+    if context is None or context.compiled is None:
+        # exec_driver_sql: nothing was compiled
+        return "raw"
+    return CACHE_RESULTS.get(context.cache_hit, "unknown")
+
+
+def instrument_engine(engine, name: str = "primary"):
+    """Time the statements of the async `engine`, count them into the current request and log the slow ones."""
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        metrics.DB_QUERY_SECONDS.labels(name).observe(elapsed)
+        metrics.SQL_COMPILE_CACHE.labels(name, cache_result(context)).inc()
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_seconds += elapsed
+        if elapsed * 1000 >= settings.SLOW_QUERY_MS:
+            logger.warning("slow query", extra={
+                "database": name,
+                "duration_ms": round(elapsed * 1000, 1),
+                "statement": statement,
+                "parameters": f"{len(parameters)} parameter sets" if executemany else redact(parameters),
+            })
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(context):
+        # a failed statement never reaches after_cursor_execute
+        if context.connection is not None and context.connection.info.get("query_started"):
+            context.connection.info["query_started"].pop()
+
+
+class RequestTimingMiddleware:
+    """
+    Plain ASGI middleware rather than @app.middleware("http"): it does not buffer
+    streaming bodies, and the endpoint runs in its context so the query counts land
+    here. Server-Timing covers the time until the response starts; the histogram
+    covers the whole response, body included.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if settings.SERVER_TIMING:
+                    MutableHeaders(scope=message).append("Server-Timing", stats.server_timing(time.perf_counter() - start))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            elapsed = time.perf_counter() - start
+            _request_stats.reset(token)
+            # the route template, not the path: /posts/{id} is one series, not one per post
+            route = scope.get("route")
+            route = getattr(route, "path", "unmatched")
+            metrics.REQUEST_SECONDS.labels(scope["method"], route, str(status_code)).observe(elapsed)
+            metrics.REQUEST_DB_QUERIES.labels(scope["method"], route).observe(stats.queries)
+            logger.info("request", extra={
+                "method": scope["method"],
+                "path": scope["path"],
+                "route": route,
+                "status": status_code,
+                "duration_ms": round(elapsed * 1000, 1),
+                "db_queries": stats.queries,
+                "db_ms": round(stats.db_seconds * 1000, 1),
+            })
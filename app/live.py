@@ -0,0 +1,147 @@
+"""
+Live vote counts. create_vote publishes every change of a post's vote_count to
+the hub, and the hub forwards it to the WebSocket and SSE connections watching
+that post, so clients stop polling GET /posts/{id}.
+
+Each connection has one pending update per post rather than a queue of events:
+updates that arrive before the client took the previous one are merged, and a
+connection that falls further behind than LIVE_QUEUE_SIZE posts loses its
+oldest ones. Every update carries the absolute vote_count next to the delta,
+so the next update of a dropped post puts the client right again.
+"""
+
+import asyncio
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import orjson
+
+from app import metrics
+from app.config import settings
+
+
+class PubSubBackend:
+    """
+    Carries the updates between the workers: every message published by one
+    worker reaches the callbacks of all of them, the publisher included.
+    """
+
+    def publish(self, message: bytes):
+        raise NotImplementedError
+
+    def subscribe(self, callback: Callable[[bytes], None]):
+        raise NotImplementedError
+
+
+class LocalPubSubBackend(PubSubBackend):
+    """
+    One process only; the stand-in for redis PUBLISH / SUBSCRIBE, whose listener
+    task would call the callbacks with the messages of the other workers.
+    """
+
+    def __init__(self):
+        self._callbacks: list[Callable[[bytes], None]] = []
+
+    def publish(self, message):
+        for callback in self._callbacks:
+            callback(message)
+
+    def subscribe(self, callback):
+        self._callbacks.append(callback)
+
+
+class Subscription:
+    """The posts one connection watches, and the updates it has not taken yet."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.post_ids: set[int] = set()
+        self.dropped = 0
+        self._pending: OrderedDict[int, dict] = OrderedDict()
+        self._ready = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+
+    def offer(self, update: dict):
+        try:
+            same_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            same_loop = False
+        if same_loop:
+            self._merge(update)
+        else:
+            self._loop.call_soon_threadsafe(self._merge, update)
+
+    def _merge(self, update: dict):
+        pending = self._pending.get(update["post_id"])
+        if pending is not None:
+            pending["delta"] += update["delta"]
+            if update["vote_count"] is not None:
+                pending["vote_count"] = update["vote_count"]
+            return
+        if len(self._pending) >= self.maxsize:
+            self._pending.popitem(last=False)
+            self.dropped += 1
+            metrics.LIVE_UPDATES_DROPPED.inc()
+        self._pending[update["post_id"]] = dict(update)
+        self._ready.set()
+
+    async def next(self, timeout: Optional[float] = None) -> list[dict]:
+        """The pending updates, oldest post first; empty if none came within `timeout` seconds."""
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        self._ready.clear()
+        updates = list(self._pending.values())
+        self._pending.clear()
+        return updates
+
+
+class LiveHub:
+    """Routes the updates of this worker's backend to its subscriptions, by post id."""
+
+    def __init__(self, backend: PubSubBackend, queue_size: int = 100):
+        self.backend = backend
+        self.queue_size = queue_size
+        self._subscribers: dict[int, set[Subscription]] = {}
+        backend.subscribe(self._deliver)
+
+    def open(self) -> Subscription:
+        metrics.LIVE_CONNECTIONS.inc()
+        return Subscription(self.queue_size)
+
+    def close(self, subscription: Subscription):
+        self.unsubscribe(subscription, list(subscription.post_ids))
+        metrics.LIVE_CONNECTIONS.dec()
+
+    def subscribe(self, subscription: Subscription, post_ids):
+        for post_id in post_ids:
+            subscription.post_ids.add(post_id)
+            self._subscribers.setdefault(post_id, set()).add(subscription)
+
+    def unsubscribe(self, subscription: Subscription, post_ids):
+        for post_id in post_ids:
+            subscription.post_ids.discard(post_id)
+            watchers = self._subscribers.get(post_id)
+            if watchers is not None:
+                watchers.discard(subscription)
+                if not watchers:
+                    del self._subscribers[post_id]
+
+    def publish(self, post_id: int, delta: int, vote_count: Optional[int] = None):
+        self.backend.publish(orjson.dumps({"post_id": post_id, "delta": delta, "vote_count": vote_count}))
+
+    def _deliver(self, message: bytes):
+        update = orjson.loads(message)
+        for subscription in list(self._subscribers.get(update["post_id"], ())):
+            subscription.offer(update)
+
+
+def create_pubsub_backend() -> PubSubBackend:
+    if settings.LIVE_BACKEND == "local":
+        # only the connections of the worker that took the vote hear of it
+        return LocalPubSubBackend()
+    raise ValueError(f"Unknown live backend {settings.LIVE_BACKEND!r}, expected 'local'")
+
+
+hub = LiveHub(create_pubsub_backend(), queue_size=settings.LIVE_QUEUE_SIZE)
@@ -6,16 +6,31 @@ gunicorn -w 4 -k uvicorn.workers.UvicornWorker app.main:app --bind 0.0.0.0:8000
 fetch('http://localhost:8000/').then(res=>res.json()).then(console.log)
 """
 
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 from . import models
-from .routers import post, user, auth, vote
+from .instrumentation import RequestTimingMiddleware
+from .logs import configure_logging
+from .routers import post, user, auth, vote, metrics, live
+from .replicas import read_router
+from .utils import hasher
 
 
 # models.Base.metadata.create_all(bind=engine)
 
-app = FastAPI()
+configure_logging()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    hasher.shutdown()
+    await read_router.dispose()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 origins = ["https://www.google.com"]
 app.add_middleware(
@@ -25,11 +40,15 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# outermost, so that its timings include the other middleware
+app.add_middleware(RequestTimingMiddleware)
 
 app.include_router(post.router)
 app.include_router(user.router)
 app.include_router(auth.router)
 app.include_router(vote.router)
+app.include_router(metrics.router)
+app.include_router(live.router)
     
 
 # Request get method url find for the first path match
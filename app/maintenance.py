@@ -0,0 +1,48 @@
+"""
+Maintenance commands, run them from the project root:
+
+python -m app.maintenance reconcile-vote-counts
+"""
+
+import argparse
+import asyncio
+
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import models
+
+
+async def reconcile_vote_counts(db: AsyncSession) -> list[int]:
+    """
+    Repair posts.vote_count wherever it drifted from the votes table,
+    e.g. after votes were removed by a cascading user delete or by hand.
+    Returns the ids of the repaired posts.
+    """
+    actual = select(func.count(models.Votes.post_id)) \
+        .where(models.Votes.post_id == models.Posts.id) \
+        .scalar_subquery()
+    result = await db.execute(update(models.Posts)
+                              .where(models.Posts.vote_count != actual)
+                              .values(vote_count=actual)
+                              .returning(models.Posts.id)
+                              .execution_options(synchronize_session=False))
+    repaired = [row.id for row in result]
+    await db.commit()
+    return repaired
+
+
+async def main(command: str):
+    from app.database import SessionLocal, engine
+
+    async with SessionLocal() as db:
+        if command == "reconcile-vote-counts":
+            repaired = await reconcile_vote_counts(db)
+            print(f"repaired vote_count of {len(repaired)} posts: {repaired}")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["reconcile-vote-counts"])
+    asyncio.run(main(parser.parse_args().command))
@@ -0,0 +1,123 @@
+"""
+Every metric of the app. Under several gunicorn workers set PROMETHEUS_MULTIPROC_DIR
+(see gunicorn.conf.py): the workers then share their samples through that directory
+and `multiprocess_mode` says how the gauges of the workers add up.
+"""
+from prometheus_client import Counter, Gauge, Histogram
+
+
+PASSWORD_HASH_QUEUE_DEPTH = Gauge(
+    "password_hash_queue_depth",
+    "Password hashing jobs waiting for a free worker",
+    multiprocess_mode="livesum",
+)
+PASSWORD_HASH_IN_FLIGHT = Gauge(
+    "password_hash_in_flight",
+    "Password hashing jobs running or waiting",
+    multiprocess_mode="livesum",
+)
+PASSWORD_HASH_SECONDS = Histogram(
+    "password_hash_seconds",
+    "Time spent hashing or verifying a password, queueing included",
+    ["operation"],
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0),
+)
+PASSWORD_HASH_REJECTED = Counter(
+    "password_hash_rejected_total",
+    "Password hashing jobs rejected because the pool was saturated",
+    ["operation"],
+)
+
+CACHE_REQUESTS = Counter(
+    "cache_requests_total",
+    "Cache lookups",
+    ["cache", "result"],
+)
+CACHE_HIT_AGE_SECONDS = Histogram(
+    "cache_hit_age_seconds",
+    "Age of the cached entries that were served, i.e. how stale a hit can be",
+    ["cache"],
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0),
+)
+
+RATE_LIMITED = Counter(
+    "rate_limited_total",
+    "Requests refused with 429 by the rate limiter",
+    ["limit"],
+)
+
+LIVE_CONNECTIONS = Gauge(
+    "live_connections",
+    "Open WebSocket and SSE connections watching vote counts",
+    multiprocess_mode="livesum",
+)
+LIVE_UPDATES_DROPPED = Counter(
+    "live_updates_dropped_total",
+    "Vote count updates dropped because a connection fell too far behind",
+)
+
+DB_POOL_CHECKOUT_SECONDS = Histogram(
+    "db_pool_checkout_seconds",
+    "Time spent waiting for a connection from the pool",
+    ["pool"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+DB_POOL_TIMEOUTS = Counter(
+    "db_pool_timeouts_total",
+    "Checkouts that gave up after DATABASE_POOL_TIMEOUT",
+    ["pool"],
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out",
+    "Connections currently checked out of the pool",
+    ["pool"],
+    multiprocess_mode="livesum",
+)
+DB_POOL_SATURATION = Gauge(
+    "db_pool_saturation",
+    "Checked out connections / (pool size + max overflow)",
+    ["pool"],
+    # of the busiest worker, each one has its own pool
+    multiprocess_mode="livemax",
+)
+
+DB_READS = Counter(
+    "db_reads_total",
+    "Read-only requests by the database that served them",
+    ["database"],
+)
+
+VOTE_BATCH_SIZE = Histogram(
+    "vote_batch_size",
+    "Votes written per batch when VOTE_BATCHING is on",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500),
+)
+VOTE_BATCH_SECONDS = Histogram(
+    "vote_batch_seconds",
+    "Time spent writing and committing one batch of votes",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+
+REQUEST_SECONDS = Histogram(
+    "http_request_seconds",
+    "Time to serve a request, body included",
+    ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+REQUEST_DB_QUERIES = Histogram(
+    "http_request_db_queries",
+    "Database statements executed per request",
+    ["method", "route"],
+    buckets=(0, 1, 2, 3, 5, 10, 25, 50, 100),
+)
+SQL_COMPILE_CACHE = Counter(
+    "sql_compile_cache_total",
+    "Statements executed, by whether SQLAlchemy found their compiled form in its cache",
+    ["database", "result"],
+)
+DB_QUERY_SECONDS = Histogram(
+    "db_query_seconds",
+    "Time spent executing one statement",
+    ["database"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
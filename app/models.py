@@ -1,9 +1,10 @@
 from app.database import Base
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey
+from sqlalchemy import Column, Computed, Integer, String, Boolean, ForeignKey, Index
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.sql import expression
 from sqlalchemy.sql.functions import func
 from sqlalchemy.sql.sqltypes import TIMESTAMP
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import deferred, relationship
 
 class Posts(Base):
     __tablename__ = "posts"
@@ -13,8 +14,23 @@ class Posts(Base):
     content = Column(String, nullable=False)
     published = Column(Boolean,  default=True, server_default=expression.true(), nullable=False)
     created_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), nullable=False)
+    # bumped by every update and vote, the version behind the post's ETag / Last-Modified
+    updated_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), nullable=False)
     owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    # number of rows in votes for this post, kept up to date by create_vote
+    vote_count = Column(Integer, default=0, server_default="0", nullable=False)
     owner = relationship("Users", foreign_keys=[owner_id])
+    # full-text document for the `search` parameter, maintained by postgres itself.
+    # deferred: it is only used in WHERE / ORDER BY, never worth sending back
+    search_vector = deferred(Column(TSVECTOR, Computed(
+        "setweight(to_tsvector('simple', title), 'A') || setweight(to_tsvector('simple', content), 'B')",
+        persisted=True)))
+
+    __table_args__ = (
+        # keyset pagination of the listing walks (created_at, id) backwards
+        Index("ix_posts_created_at_id", "created_at", "id"),
+        Index("ix_posts_search_vector", "search_vector", postgresql_using="gin"),
+    )
     
 
 class Users(Base):
@@ -1,9 +1,13 @@
+import hashlib
+import time
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
 from app import schemas, models
+from app.cache import TTLCache
 from fastapi import HTTPException, Depends, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import bindparam, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import get_db
 from app.config import settings
 
@@ -13,6 +17,14 @@ SECRET_KEY = settings.SECRET_KEY
 ALGORITHM = settings.ALGORITHM
 ACCESS_TOKEN_EXPIRE_MINUTES = settings.ACCESS_TOKEN_EXPIRE_MINUTES
 
+# user id -> schemas.UserResponse of the authenticated user
+principal_cache = TTLCache("principal", maxsize=settings.PRINCIPAL_CACHE_SIZE, ttl=settings.PRINCIPAL_CACHE_TTL)
+# sha256(token) -> schemas.TokenData, each entry expires with the token itself
+token_cache = TTLCache("access_token", maxsize=settings.TOKEN_CACHE_SIZE, ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+# built once: reused with its cache key instead of rebuilt on every cache miss
+USER_BY_ID = select(models.Users).where(models.Users.id == bindparam("id"))
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -22,20 +34,58 @@ def create_access_token(data: dict):
     return encoded_jwt
 
 
+def user_claims(user: models.Users) -> dict:
+    claims = {"user_id": user.id}
+    if settings.EMBED_USER_CLAIMS:
+        claims.update({"email": user.email, "created_at": user.created_at.isoformat()})
+    return claims
+
+
 def verify_access_token(token: str, credentials_exception):
+    # the same bearer token arrives many times a minute, only decode it once
+    digest = hashlib.sha256(token.encode()).digest()
+    token_data = token_cache.get(digest)
+    if token_data is not None:
+        return token_data
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         id = payload.get("user_id")
         if id is None:
             raise credentials_exception
-        token_data = schemas.TokenData(id=id)
+        token_data = schemas.TokenData(id=id, email=payload.get("email"), created_at=payload.get("created_at"))
     except JWTError:
         raise credentials_exception
+    exp = payload.get("exp")
+    token_cache.set(digest, token_data, ttl=None if exp is None else exp - time.time())
     return token_data
-    
 
-def get_current_user(token: str = Depends(oath2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials", headers={"WWW-Authenticate": "Bearer"})
+
+def invalidate_user(user_id: int):
+    """Call whenever a user row changes, so the next request reloads it."""
+    principal_cache.delete(user_id)
+
+
+def get_credentials_exception():
+    return HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials", headers={"WWW-Authenticate": "Bearer"})
+
+
+async def get_current_user_id(token: str = Depends(oath2_scheme)) -> int:
+    """For handlers that only need the id: verifies the token and never touches the database."""
+    return verify_access_token(token, get_credentials_exception()).id
+
+
+async def get_current_user(token: str = Depends(oath2_scheme), db: AsyncSession = Depends(get_db)) -> schemas.UserResponse:
+    credentials_exception = get_credentials_exception()
     token = verify_access_token(token, credentials_exception)
-    db_user = db.query(models.Users).filter(models.Users.id == token.id).first()
-    return db_user
\ No newline at end of file
+    if token.email is not None and token.created_at is not None:
+        return schemas.UserResponse(id=token.id, email=token.email, created_at=token.created_at)
+
+    user = principal_cache.get(token.id)
+    if user is None:
+        result = await db.execute(USER_BY_ID, {"id": token.id})
+        db_user = result.scalars().first()
+        if db_user is None:
+            raise credentials_exception
+        user = schemas.UserResponse.model_validate(db_user)
+        principal_cache.set(token.id, user)
+    return user
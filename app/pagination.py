@@ -0,0 +1,25 @@
+import base64
+import json
+from datetime import datetime
+
+from fastapi import HTTPException, status
+
+
+def encode_cursor(*values) -> str:
+    """Opaque cursor for keyset pagination: the sort key of the last row of a page."""
+    raw = json.dumps([value.isoformat() if isinstance(value, datetime) else value for value in values],
+                     separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, *types) -> tuple:
+    """Inverse of encode_cursor, `types` converts each value back (datetime, int, ...)."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError(cursor)
+        return tuple(datetime.fromisoformat(value) if type_ is datetime else type_(value)
+                     for type_, value in zip(types, values))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
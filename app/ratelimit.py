@@ -0,0 +1,204 @@
+"""
+Token-bucket rate limiting of the expensive routes.
+
+A limit of "10/minute" is a bucket of 10 tokens refilled at 10 per minute: a
+client may burst 10 requests, then gets one more every 6 seconds. Buckets are
+kept per client IP for the anonymous routes (login, signup) and per user for
+the authenticated ones. Responses carry the RateLimit-* headers of the IETF
+draft, and a 429 says when to retry.
+"""
+
+import math
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import NamedTuple
+
+from fastapi import Depends, HTTPException, Request, Response, status
+
+from app import metrics, oauth2
+from app.cache import InMemoryKeyValueStore, KeyValueStore
+from app.config import settings
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+class Limit(NamedTuple):
+    capacity: int
+    period: float
+
+    @classmethod
+    def parse(cls, limit: str) -> "Limit":
+        """'10/minute' -> Limit(10, 60)"""
+        count, _, period = limit.partition("/")
+        # at least one token a period: an empty bucket would never refill (and divides by zero)
+        if period not in PERIODS or not count.strip().isdigit() or int(count) < 1 or PERIODS[period] <= 0:
+            raise ValueError(f"Invalid rate limit {limit!r}, expected e.g. '10/minute' with a count of at least 1")
+        return cls(int(count), PERIODS[period])
+
+    @property
+    def rate(self) -> float:
+        """Tokens refilled per second."""
+        return self.capacity / self.period
+
+
+class Decision(NamedTuple):
+    allowed: bool
+    remaining: int
+    # seconds until the bucket is full again
+    reset: float
+    # seconds until the next token, when refused
+    retry_after: float
+
+
+def take(limit: Limit, tokens: float, updated_at: float, now: float, cost: int = 1) -> tuple[Decision, float]:
+    """Refill a bucket holding `tokens` at `updated_at` up to `now`, take `cost` tokens if there are as many."""
+    tokens = min(limit.capacity, tokens + (now - updated_at) * limit.rate)
+    allowed = tokens >= cost
+    if allowed:
+        tokens -= cost
+    decision = Decision(allowed=allowed,
+                        remaining=int(tokens),
+                        reset=(limit.capacity - tokens) / limit.rate,
+                        retry_after=0.0 if allowed else (cost - tokens) / limit.rate)
+    return decision, tokens
+
+
+class RateLimitBackend:
+    """Where the buckets live."""
+
+    def hit(self, key: str, limit: Limit, cost: int = 1) -> Decision:
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class LocalRateLimitBackend(RateLimitBackend):
+    """
+    Buckets in the worker's memory, the least recently used dropped beyond `maxsize`.
+    Each gunicorn worker counts on its own, so a client gets up to workers x limit.
+    """
+
+    def __init__(self, maxsize: int = 100000, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.clock = clock
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self._lock = Lock()
+
+    def hit(self, key, limit, cost=1):
+        with self._lock:
+            now = self.clock()
+            tokens, updated_at = self._buckets.pop(key, (limit.capacity, now))
+            decision, tokens = take(limit, tokens, updated_at, now, cost)
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+            return decision
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class SharedRateLimitBackend(RateLimitBackend):
+    """
+    Buckets in a store shared by all workers, so a limit holds for the whole
+    deployment. A bucket is "tokens:timestamp", updated with compare-and-set and
+    retried when another worker got there first.
+    """
+
+    def __init__(self, store: KeyValueStore, prefix: str = "fastapi:ratelimit:", clock=time.time, attempts: int = 10):
+        self.store = store
+        self.prefix = prefix
+        # wall clock: the workers have to agree on it
+        self.clock = clock
+        self.attempts = attempts
+
+    def hit(self, key, limit, cost=1):
+        key = self.prefix + key
+        for _ in range(self.attempts):
+            now = self.clock()
+            raw = self.store.get_many([key])[0]
+            tokens, updated_at = (float(part) for part in raw.split(b":")) if raw else (limit.capacity, now)
+            decision, tokens = take(limit, tokens, updated_at, now, cost)
+            if self.store.compare_and_set(key, raw, f"{tokens}:{now}".encode(), ttl=limit.period):
+                return decision
+        # heavy contention on one key: let the request through rather than fail it
+        return Decision(allowed=True, remaining=0, reset=limit.period, retry_after=0.0)
+
+    def clear(self):
+        self.store.flush()
+
+
+def create_rate_limit_backend() -> RateLimitBackend:
+    if settings.RATE_LIMIT_BACKEND == "local":
+        return LocalRateLimitBackend()
+    if settings.RATE_LIMIT_BACKEND == "shared":
+        # swap the stand-in for a redis-backed KeyValueStore to limit across workers
+        return SharedRateLimitBackend(InMemoryKeyValueStore())
+    raise ValueError(f"Unknown rate limit backend {settings.RATE_LIMIT_BACKEND!r}, expected 'local' or 'shared'")
+
+
+backend = create_rate_limit_backend()
+
+
+def client_ip(request: Request) -> str:
+    # nginx sets X-Real-IP to the address it got the request from; without nginx in
+    # front the header comes from the client, so RATE_LIMIT_TRUST_X_REAL_IP must be off
+    if settings.RATE_LIMIT_TRUST_X_REAL_IP and request.headers.get("x-real-ip"):
+        return request.headers["x-real-ip"]
+    return request.client.host if request.client else "unknown"
+
+
+def enforce(name: str, key: str, limit: Limit, response: Response, cost: int = 1):
+    if cost > limit.capacity:
+        # would never fit in the bucket, retrying cannot help
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"At most {limit.capacity} items per request under the {name} rate limit")
+    decision = backend.hit(f"{name}:{key}", limit, cost)
+    headers = {
+        "RateLimit-Limit": str(limit.capacity),
+        "RateLimit-Remaining": str(decision.remaining),
+        "RateLimit-Reset": str(math.ceil(decision.reset)),
+        "RateLimit-Policy": f"{limit.capacity};w={int(limit.period)}",
+    }
+    if not decision.allowed:
+        metrics.RATE_LIMITED.labels(name).inc()
+        headers["Retry-After"] = str(math.ceil(decision.retry_after))
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Too many requests", headers=headers)
+    response.headers.update(headers)
+
+
+def configured_limit(name: str) -> Limit:
+    """settings.RATE_LIMIT_<NAME>, read on every call so that it can be changed at runtime."""
+    return Limit.parse(getattr(settings, f"RATE_LIMIT_{name.upper()}"))
+
+
+def limit_per_ip(name: str):
+    """Dependency limiting route `name` per client IP to settings.RATE_LIMIT_<NAME>."""
+    # a bad setting fails at startup rather than on every request
+    configured_limit(name)
+
+    async def dependency(request: Request, response: Response):
+        if settings.RATE_LIMIT_ENABLED:
+            enforce(name, client_ip(request), configured_limit(name), response)
+    return dependency
+
+
+def limit_user(name: str, user_id: int, response: Response, cost: int = 1):
+    """
+    What limit_per_user does, for handlers whose cost is only known from the body:
+    a bulk request takes one token per item, as the same items sent one by one would.
+    """
+    if settings.RATE_LIMIT_ENABLED:
+        enforce(name, f"user:{user_id}", configured_limit(name), response, cost)
+
+
+def limit_per_user(name: str):
+    """Dependency limiting route `name` per authenticated user to settings.RATE_LIMIT_<NAME>."""
+    configured_limit(name)
+
+    async def dependency(response: Response, current_user_id: int = Depends(oauth2.get_current_user_id)):
+        limit_user(name, current_user_id, response)
+    return dependency
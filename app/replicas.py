@@ -0,0 +1,103 @@
+import itertools
+from contextlib import asynccontextmanager
+from typing import AsyncContextManager, Optional
+
+from fastapi import Depends
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from app import metrics
+from app.cache import TTLCache
+from app.config import settings
+from app.database import create_db_engine, get_db
+from app.oauth2 import get_current_user_id
+
+
+class Replica:
+    def __init__(self, name: str, engine: AsyncEngine):
+        self.name = name
+        self.engine = engine
+        self.SessionLocal = sessionmaker(self.engine, class_=AsyncSession, autocommit=False, autoflush=False, expire_on_commit=False)
+        # sessions handed out and not closed yet, for least_connections
+        self.in_use = 0
+
+
+class ReplicaRouter:
+    """
+    Picks the database a read-only request goes to.
+
+    Reads go to one of the replicas, chosen round robin or by the fewest sessions
+    in use. A user who wrote less than `sticky_seconds` ago reads from the primary
+    instead, so they see their own write even if the replicas lag behind.
+    The stickiness is remembered per worker process.
+    """
+
+    def __init__(self, urls: list[str], strategy: str = "round_robin", sticky_seconds: float = 5.0):
+        if strategy not in ("round_robin", "least_connections"):
+            raise ValueError(f"Unknown replica strategy {strategy!r}, expected 'round_robin' or 'least_connections'")
+        self.replicas = [Replica(f"replica{i}", create_db_engine(url, name=f"replica{i}")) for i, url in enumerate(urls)]
+        self.strategy = strategy
+        self._turn = itertools.count()
+        self._recent_writers = TTLCache("recent_writers", maxsize=100000, ttl=sticky_seconds)
+
+    @classmethod
+    def from_settings(cls):
+        urls = [url.strip() for url in settings.DATABASE_REPLICA_URLS.split(",") if url.strip()]
+        return cls(urls, settings.DATABASE_REPLICA_STRATEGY, settings.DATABASE_READ_YOUR_WRITES_SECONDS)
+
+    def mark_write(self, user_id: int):
+        if self.replicas:
+            self._recent_writers.set(user_id, True)
+
+    def choose(self, user_id: Optional[int] = None) -> Optional[Replica]:
+        """The replica to read from, None means the primary."""
+        if not self.replicas or (user_id is not None and self._recent_writers.get(user_id)):
+            return None
+        if self.strategy == "least_connections":
+            return min(self.replicas, key=lambda replica: replica.in_use)
+        return self.replicas[next(self._turn) % len(self.replicas)]
+
+    async def dispose(self):
+        for replica in self.replicas:
+            await replica.engine.dispose()
+
+
+read_router = ReplicaRouter.from_settings()
+
+
+@asynccontextmanager
+async def replica_session(replica: Replica):
+    replica.in_use += 1
+    db = replica.SessionLocal()
+    try:
+        yield db
+    finally:
+        replica.in_use -= 1
+        await db.close()
+
+
+async def get_read_db(current_user_id: int = Depends(get_current_user_id), primary: AsyncSession = Depends(get_db)):
+    """get_db for read-only handlers: a replica session unless the user has just written."""
+    # the primary session only connects if it is actually used
+    replica = read_router.choose(current_user_id)
+    metrics.DB_READS.labels("primary" if replica is None else replica.name).inc()
+    if replica is None:
+        yield primary
+        return
+    async with replica_session(replica) as db:
+        yield db
+
+
+async def get_streaming_read_db(current_user_id: int = Depends(get_current_user_id),
+                                primary: AsyncSession = Depends(get_db)) -> AsyncContextManager[AsyncSession]:
+    """
+    get_read_db for a StreamingResponse, whose dependencies are torn down before
+    the body is sent: the session comes as a context manager for the body to enter,
+    so it stays open, and counted in the replica's in_use, until the last chunk.
+    """
+    replica = read_router.choose(current_user_id)
+    metrics.DB_READS.labels("primary" if replica is None else replica.name).inc()
+    if replica is None:
+        # get_db closes it before the body starts; the session reconnects and `async with` closes it again
+        return primary
+    return replica_session(replica)
@@ -0,0 +1,113 @@
+import asyncio
+from typing import Optional
+
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Query, WebSocket, WebSocketDisconnect, WebSocketException, status
+from fastapi.responses import StreamingResponse
+from fastapi.security import OAuth2PasswordBearer
+
+from app import oauth2
+from app.config import settings
+from app.live import Subscription, hub
+
+router = APIRouter(
+    prefix="/live",
+    tags=["Live"]
+)
+
+# browsers cannot set headers on a WebSocket or an EventSource, so the token may come as ?token= too
+optional_bearer = OAuth2PasswordBearer(tokenUrl="login", auto_error=False)
+
+
+def authenticate(token: Optional[str]) -> int:
+    if not token:
+        raise oauth2.get_credentials_exception()
+    return oauth2.verify_access_token(token, oauth2.get_credentials_exception()).id
+
+
+def check_post_ids(subscription: Subscription, post_ids: list[int]):
+    if len(subscription.post_ids | set(post_ids)) > settings.LIVE_MAX_POSTS:
+        raise ValueError(f"At most {settings.LIVE_MAX_POSTS} posts per connection")
+
+
+@router.websocket("/ws")
+async def live_websocket(websocket: WebSocket, token: Optional[str] = None, post_ids: list[int] = Query([])):
+    """
+    Sends {"updates": [{"post_id", "delta", "vote_count"}, ...]} whenever votes move
+    the watched posts. The client changes what it watches with
+    {"subscribe": [ids]} / {"unsubscribe": [ids]}, each acknowledged with
+    {"post_ids": [every watched id]}.
+    """
+    try:
+        authenticate(token or websocket.headers.get("authorization", "").removeprefix("Bearer "))
+    except HTTPException:
+        raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason="Could not validate credentials")
+    await websocket.accept()
+    subscription = hub.open()
+    try:
+        check_post_ids(subscription, post_ids)
+        hub.subscribe(subscription, post_ids)
+        sender = asyncio.create_task(send_updates(websocket, subscription))
+        try:
+            while True:
+                command = await websocket.receive_json()
+                try:
+                    if not isinstance(command, dict):
+                        raise ValueError("Expected {\"subscribe\": [ids]} or {\"unsubscribe\": [ids]}")
+                    subscribe = [int(post_id) for post_id in command.get("subscribe", [])]
+                    unsubscribe = [int(post_id) for post_id in command.get("unsubscribe", [])]
+                    check_post_ids(subscription, subscribe)
+                except (TypeError, ValueError) as exc:
+                    await websocket.send_json({"error": str(exc)})
+                    continue
+                hub.subscribe(subscription, subscribe)
+                hub.unsubscribe(subscription, unsubscribe)
+                await websocket.send_json({"post_ids": sorted(subscription.post_ids)})
+        finally:
+            sender.cancel()
+    except ValueError as exc:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=str(exc))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        hub.close(subscription)
+
+
+async def send_updates(websocket: WebSocket, subscription: Subscription):
+    # uvicorn pings WebSocket clients itself, no heartbeat needed here
+    while True:
+        updates = await subscription.next()
+        await websocket.send_text(orjson.dumps({"updates": updates}).decode())
+
+
+async def sse_events(subscription: Subscription, heartbeat: float):
+    """Server-sent events of `subscription`, with a comment line every `heartbeat` idle seconds."""
+    try:
+        yield f"retry: {settings.LIVE_SSE_RETRY_MS}\n\n"
+        while True:
+            updates = await subscription.next(heartbeat)
+            if not updates:
+                # keeps proxies from closing an idle connection
+                yield ": heartbeat\n\n"
+            for update in updates:
+                yield f"event: vote_count\ndata: {orjson.dumps(update).decode()}\n\n"
+    finally:
+        hub.close(subscription)
+
+
+@router.get("/posts")
+async def live_posts(post_ids: list[int] = Query(...), token: Optional[str] = None,
+                     bearer: Optional[str] = Depends(optional_bearer)):
+    """An event stream of vote_count events for `post_ids`, the same updates the WebSocket sends."""
+    authenticate(token or bearer)
+    if len(set(post_ids)) > settings.LIVE_MAX_POSTS:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail=f"At most {settings.LIVE_MAX_POSTS} posts per connection")
+    subscription = hub.open()
+    hub.subscribe(subscription, post_ids)
+    return StreamingResponse(
+        sse_events(subscription, settings.LIVE_HEARTBEAT_SECONDS),
+        media_type="text/event-stream",
+        # X-Accel-Buffering: nginx would otherwise hold the events back in its buffers
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
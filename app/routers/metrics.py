@@ -0,0 +1,17 @@
+import os
+
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, generate_latest, multiprocess
+
+router = APIRouter(
+    tags=["Metrics"]
+)
+
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        # whichever worker gets the scrape reports the samples of all of them
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(content=generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -1,39 +1,218 @@
-from typing import Optional
+import csv
+import io
+import logging
+import re
+import zlib
+from datetime import datetime
+from functools import lru_cache
+from typing import AsyncContextManager, AsyncIterator, Literal, Optional
 
+import orjson
 from httpx import post
-from .. import models, schemas, oauth2
+from .. import models, schemas, oauth2, utils
+from ..cache import POSTS_LIST_TAG, POSTS_SEARCH_TAG, post_tag, response_cache
+from ..conditional import content_etag, is_conditional, not_modified, not_modified_response, post_etag, validators
+from ..config import settings
 from ..database import get_db
-from fastapi import FastAPI, Response, status, HTTPException, Depends, APIRouter
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from ..feeds import feed_index
+from ..replicas import get_read_db, get_streaming_read_db, read_router
+from ..pagination import decode_cursor, encode_cursor
+from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, Query, Request, Response, status, HTTPException, Depends, APIRouter
+from sqlalchemy import Boolean, Integer, and_, String, bindparam, column, delete, exists, func, insert, literal_column, select, tuple_, update, values
+from sqlalchemy.dialects.postgresql import REAL
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from sqlalchemy.sql import Select
 
 router = APIRouter(
     prefix="/posts",
     tags=["Posts"]
 )
 
+logger = logging.getLogger(__name__)
+
+
+# PostResponse nests the owner: join it into the same SELECT (a lazy load per post is
+# not even allowed on an AsyncSession) and only fetch the columns UserResponse needs
+load_owner = joinedload(models.Posts.owner, innerjoin=True) \
+    .load_only(models.Users.id, models.Users.email, models.Users.created_at)
+
+
+def has_voted():
+    """
+    Whether the viewer (the `viewer_id` parameter) voted the post: one probe of the
+    votes primary key per row, inside the same query, so a page costs no extra round trip.
+    """
+    return exists().where(and_(models.Votes.post_id == models.Posts.id,
+                               models.Votes.user_id == bindparam("viewer_id", type_=Integer))).label("has_voted")
+
+
+def select_posts_with_votes():
+    # votes is the denormalized posts.vote_count, so counting never touches the votes table
+    return select(models.Posts, models.Posts.vote_count.label("votes"), has_voted()).options(load_owner)
+
+
+def select_post_rows():
+    """The columns of PostWithVote as flat Core rows, no ORM instances are built for them."""
+    return select(models.Posts.id, models.Posts.title, models.Posts.content, models.Posts.published,
+                  models.Posts.created_at, models.Posts.owner_id, models.Posts.vote_count.label("votes"),
+                  models.Users.email.label("owner_email"), models.Users.created_at.label("owner_created_at"),
+                  has_voted()) \
+        .join(models.Posts.owner)
+
+
+# the hot single-post statements, built once with bound parameters (see posts_page_statement)
+POST_BY_ID = select_posts_with_votes().where(models.Posts.id == bindparam("id"))
+POST_VERSION = select(models.Posts.updated_at, models.Posts.vote_count, has_voted()).where(models.Posts.id == bindparam("id"))
+POSTS_BY_IDS = select_posts_with_votes().where(models.Posts.id.in_(bindparam("ids", expanding=True)))
+
+
+def post_row_to_dict(row) -> dict:
+    # same keys, order and values as schemas.PostWithVote
+    return {
+        "Posts": {
+            "title": row.title,
+            "content": row.content,
+            "published": row.published,
+            "id": row.id,
+            "created_at": row.created_at,
+            "owner_id": row.owner_id,
+            "owner": {"id": row.owner_id, "email": row.owner_email, "created_at": row.owner_created_at},
+        },
+        "votes": row.votes,
+        "has_voted": row.has_voted,
+    }
+
+
+def search_tsquery(search: Optional[str]) -> Optional[str]:
+    """'fast api' -> 'fast:* & api:*': every word has to prefix-match a word of the title or content."""
+    words = re.findall(r"\w+", search or "")
+    if not words:
+        return None
+    return " & ".join(f"{word}:*" for word in words)
+
+
+@lru_cache(maxsize=None)
+def posts_page_statement(rows: bool, searching: bool, after: bool, skipping: bool):
+    """
+    The statement of one shape of page, built once: every value is a bound
+    parameter, so the statement and its cache key are reused on every request
+    and SQLAlchemy compiles it once per worker, asyncpg prepares it once per connection.
+    """
+    query = (select_post_rows() if rows else select_posts_with_votes()).limit(bindparam("limit"))
+    sort_key = [models.Posts.created_at, models.Posts.id]
+    if searching:
+        # served by the GIN index on search_vector
+        tsquery = func.to_tsquery(literal_column("'simple'::regconfig"), bindparam("tsquery", type_=String))
+        rank = func.ts_rank(models.Posts.search_vector, tsquery, type_=REAL)
+        query = query.add_columns(rank.label("rank")).where(models.Posts.search_vector.op("@@")(tsquery))
+        sort_key.insert(0, rank)
+
+    query = query.order_by(*(column.desc() for column in sort_key))
+    if after:
+        bounds = [bindparam(f"after_{i}", type_=column.type) for i, column in enumerate(sort_key)]
+        return query.where(tuple_(*sort_key) < tuple_(*bounds))
+    return query.offset(bindparam("skip")) if skipping else query
+
+
+def select_posts_page(limit: int, viewer_id: int, skip: int = 0, search: Optional[str] = "", cursor: Optional[str] = None,
+                      rows: bool = False) -> tuple[Select, dict]:
+    """
+    Newest posts first, or best match first when searching. With a `cursor`
+    (the `X-Next-Cursor` of the previous page) the page starts right after the
+    last row seen, which costs the same on page 1 and page 10,000. `skip` is
+    only applied without a cursor and gets linearly slower with depth.
+
+    Returns the statement and its parameters, for db.execute(statement, parameters);
+    has_voted is that of the user `viewer_id`.
+    rows=True pages select_post_rows() instead of select_posts_with_votes().
+    """
+    parameters = {"limit": limit, "viewer_id": viewer_id}
+    key_types = [datetime, int]
+    tsquery = search_tsquery(search)
+    if tsquery:
+        parameters["tsquery"] = tsquery
+        key_types.insert(0, float)
+    if cursor:
+        parameters.update((f"after_{i}", value) for i, value in enumerate(decode_cursor(cursor, *key_types)))
+    elif skip:
+        parameters["skip"] = skip
+    return posts_page_statement(rows, bool(tsquery), bool(cursor), bool(skip) and not cursor), parameters
+
+
+def next_cursor(row) -> str:
+    """Cursor pointing right after `row`, a row of select_posts_page."""
+    post = row.Posts if "Posts" in row._fields else row
+    key = (post.created_at, post.id)
+    if "rank" in row._fields:
+        key = (row.rank,) + key
+    return encode_cursor(*key)
+
+
+def cached_response(key: str, request: Request) -> Optional[Response]:
+    """The cached json of `key`, with its `Age` in seconds, or None on a miss."""
+    entry = response_cache.get(key)
+    if entry is None:
+        return None
+    content, headers = entry.value
+    return json_response(request, content, {**headers, "X-Cache": "HIT", "Age": str(int(entry.age))})
+
+
+def cache_response(key: str, request: Request, content: bytes, headers: dict, tags: list[str],
+                   cache_version) -> Response:
+    """Cache and send `content`; not cached if a write invalidated anything since `cache_version` was taken."""
+    response_cache.set(key, (content, headers), tags=tags, version=cache_version)
+    return json_response(request, content, {**headers, "X-Cache": "MISS"})
+
+
+def json_response(request: Request, content: bytes, headers: dict) -> Response:
+    if not_modified(request, headers):
+        return not_modified_response(headers)
+    return Response(content=content, media_type="application/json", headers=headers)
+
 
 @router.get("/", response_model=list[schemas.PostWithVote])
-async def get_posts(db: Session = Depends(get_db), 
-                    current_user: models.Users = Depends(oauth2.get_current_user),
-                    limit: int = 10,
+async def get_posts(request: Request,
+                    db: AsyncSession = Depends(get_read_db), 
+                    current_user_id: int = Depends(oauth2.get_current_user_id),
+                    limit: int = Query(10, ge=1, le=100),
                     skip: int = 0,
-                    search: Optional[str] = ""):
+                    search: Optional[str] = "",
+                    cursor: Optional[str] = None):
     # cursor.execute("SELECT * FROM posts")
     # posts = cursor.fetchall()
-    posts_with_votes = db.query(models.Posts, func.count(models.Votes.post_id) \
-                                .label("votes")).outerjoin(models.Votes) \
-                                .group_by(models.Posts.id) \
-                                .filter(models.Posts.title.contains(search)) \
-                                .limit(limit) \
-                                .offset(skip) \
-                                .all()
+    # has_voted makes every page the viewer's own
+    key = f"posts:list:{current_user_id}:{limit}:{skip}:{search}:{cursor}"
+    response = cached_response(key, request)
+    if response is not None:
+        return response
+
+    # before the read: a write committing while it runs keeps the result out of the cache
+    cache_version = response_cache.version()
+    if settings.POSTS_ROW_SERIALIZATION:
+        result = await db.execute(*select_posts_page(limit, current_user_id, skip, search, cursor, rows=True))
+        posts_with_votes = result.all()
+        content = orjson.dumps([post_row_to_dict(row) for row in posts_with_votes], option=orjson.OPT_UTC_Z)
+    else:
+        result = await db.execute(*select_posts_page(limit, current_user_id, skip, search, cursor))
+        posts_with_votes = result.all()
+        # one pass from rows to json bytes, no intermediate list of dicts
+        content = schemas.PostWithVoteList.dump_json(schemas.PostWithVoteList.validate_python(posts_with_votes))
 
-    return posts_with_votes
+    # a page has no single row version, its ETag hashes the body
+    headers = {**validators(content_etag(content)), "Vary": "Authorization"}
+    if posts_with_votes and len(posts_with_votes) == limit:
+        headers["X-Next-Cursor"] = next_cursor(posts_with_votes[-1])
+    # a page changes when one of its posts does, or (any page) when posts are added or removed
+    tags = [POSTS_LIST_TAG, *(post_tag(row.Posts.id if "Posts" in row._fields else row.id) for row in posts_with_votes)]
+    if search_tsquery(search):
+        tags.append(POSTS_SEARCH_TAG)
+    return cache_response(key, request, content, headers, tags, cache_version)
 
 
 @router.post("/", status_code=status.HTTP_201_CREATED, response_model=schemas.PostResponse)
-async def create_post(post: schemas.PostCreate, db: Session = Depends(get_db), current_user: models.Users = Depends(oauth2.get_current_user)):
+async def create_post(post: schemas.PostCreate, db: AsyncSession = Depends(get_db), current_user: schemas.UserResponse = Depends(oauth2.get_current_user)):
     """
     Not doing this because there might be a SQL injection attack
     cursor.execute(f"INSERT INTO posts (title, content, published) VALUES ('{post.title}', '{post.content}', {post.published}) RETURNING *")
@@ -43,44 +222,279 @@ async def create_post(post: schemas.PostCreate, db: Session = Depends(get_db), c
     # new_post = cursor.fetchone()
     # conn.commit()
     # new_post = models.Posts(title=post.title, content=post.content, published=post.published)
-    print(current_user.id, current_user.email)
-    new_post = models.Posts(**post.dict(), owner_id=current_user.id)
+    logger.debug("creating post", extra={"user_id": current_user.id})
+    new_post = models.Posts(**post.model_dump(), owner_id=current_user.id)
     db.add(new_post)
-    db.commit()
-    db.refresh(new_post)
+    await db.commit()
+    read_router.mark_write(current_user.id)
+    response_cache.invalidate_tags(POSTS_LIST_TAG)
+    result = await db.execute(select(models.Posts) \
+                              .where(models.Posts.id == new_post.id) \
+                              .options(load_owner))
+    new_post = result.scalars().first()
+    feed_index.add(new_post.id, new_post.created_at)
     return new_post
 
 
+EXPORT_COLUMNS = ["id", "title", "content", "published", "created_at", "owner_id", "owner_email", "votes", "has_voted"]
+
+
+def export_ndjson(rows) -> bytes:
+    return b"".join(orjson.dumps(post_row_to_dict(row), option=orjson.OPT_UTC_Z) + b"\n" for row in rows)
+
+
+def export_csv(rows) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([getattr(row, name) for name in EXPORT_COLUMNS] for row in rows)
+    return buffer.getvalue().encode()
+
+
+async def stream_export(session: AsyncContextManager[AsyncSession], query, parameters: dict,
+                        format: str) -> AsyncIterator[bytes]:
+    """
+    Rows come from a server-side cursor EXPORT_CHUNK_SIZE at a time and leave as
+    soon as they are encoded, so memory does not grow with the table. The session
+    is entered here, see get_streaming_read_db.
+    """
+    async with session as db:
+        result = await db.stream(query, parameters)
+        if format == "csv":
+            yield ",".join(EXPORT_COLUMNS).encode() + b"\r\n"
+        encode = export_ndjson if format == "ndjson" else export_csv
+        async for rows in result.partitions(settings.EXPORT_CHUNK_SIZE):
+            yield encode(rows)
+
+
+def accepts_encoding(accept_encoding: str, coding: str) -> bool:
+    """Whether an Accept-Encoding header value allows `coding`: named, or through "*", with a q-value above 0."""
+    qvalues = {}
+    for item in accept_encoding.split(","):
+        name, *params = (part.strip() for part in item.split(";"))
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name:
+            qvalues[name.lower()] = q
+    return qvalues.get(coding, qvalues.get("*", 0.0)) > 0
+
+
+async def gzip_stream(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    try:
+        async for chunk in chunks:
+            # the compressor buffers small inputs, skip its empty outputs
+            chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+        yield compressor.flush()
+    finally:
+        await chunks.aclose()
+
+
+@router.get("/export")
+async def export_posts(request: Request,
+                       session: AsyncContextManager[AsyncSession] = Depends(get_streaming_read_db),
+                       current_user_id: int = Depends(oauth2.get_current_user_id),
+                       format: Literal["ndjson", "csv"] = "ndjson",
+                       owner_id: Optional[int] = None,
+                       published: Optional[bool] = None,
+                       created_after: Optional[datetime] = None,
+                       created_before: Optional[datetime] = None):
+    """Every post matching the filters with its votes, oldest first. Gzipped when the client accepts it."""
+    query = select_post_rows().order_by(models.Posts.id)
+    if owner_id is not None:
+        query = query.where(models.Posts.owner_id == owner_id)
+    if published is not None:
+        query = query.where(models.Posts.published == published)
+    if created_after is not None:
+        query = query.where(models.Posts.created_at >= created_after)
+    if created_before is not None:
+        query = query.where(models.Posts.created_at < created_before)
+
+    body = stream_export(session, query, {"viewer_id": current_user_id}, format)
+    headers = {"Content-Disposition": f'attachment; filename="posts.{format}"', "Vary": "Accept-Encoding, Authorization"}
+    if accepts_encoding(request.headers.get("accept-encoding", ""), "gzip"):
+        body = gzip_stream(body)
+        headers["Content-Encoding"] = "gzip"
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/csv"
+    return StreamingResponse(body, media_type=media_type, headers=headers)
+
+
+async def feed_page(name: str, db: AsyncSession, viewer_id: int, limit: int, cursor: Optional[str]) -> Response:
+    await feed_index.ensure_fresh(db)
+    after = decode_cursor(cursor, float, int) if cursor else None
+    ranked = feed_index.feeds[name].page(limit, after)
+    ids = [id for _, id in ranked]
+    result = await db.execute(POSTS_BY_IDS, {"ids": ids, "viewer_id": viewer_id})
+    by_id = {row.Posts.id: row for row in result}
+    # the order is the index's; posts deleted since it was built are skipped
+    page = [by_id[id] for id in ids if id in by_id]
+    content = schemas.PostWithVoteList.dump_json(schemas.PostWithVoteList.validate_python(page))
+    headers = {"X-Feed-Age": str(int(feed_index.age)), "Vary": "Authorization"}
+    if len(ranked) == limit:
+        headers["X-Next-Cursor"] = encode_cursor(*ranked[-1])
+    return Response(content=content, media_type="application/json", headers=headers)
+
+
+@router.get("/top", response_model=list[schemas.PostWithVote])
+async def get_top_posts(db: AsyncSession = Depends(get_read_db),
+                        current_user_id: int = Depends(oauth2.get_current_user_id),
+                        limit: int = Query(10, ge=1, le=100),
+                        cursor: Optional[str] = None):
+    """Most voted posts first. X-Feed-Age is how many seconds old the ranking's last full rebuild is."""
+    return await feed_page("top", db, current_user_id, limit, cursor)
+
+
+@router.get("/trending", response_model=list[schemas.PostWithVote])
+async def get_trending_posts(db: AsyncSession = Depends(get_read_db),
+                             current_user_id: int = Depends(oauth2.get_current_user_id),
+                             limit: int = Query(10, ge=1, le=100),
+                             cursor: Optional[str] = None):
+    """Posts by votes decayed with age, see app.feeds. X-Feed-Age as for /posts/top."""
+    return await feed_page("trending", db, current_user_id, limit, cursor)
+
+
+# The bulk routes are declared before /{id}, which would otherwise try to parse "bulk" as an id.
+# Each one is a single statement in a single transaction, whatever the number of items.
+
+async def classify_missing(db: AsyncSession, ids: list[int]) -> dict[int, str]:
+    """Why the posts `ids` were not written by their owner: they belong to someone else, or do not exist."""
+    if not ids:
+        return {}
+    result = await db.execute(select(models.Posts.id).where(models.Posts.id.in_(ids)))
+    existing = set(result.scalars())
+    return {id: "forbidden" if id in existing else "not_found" for id in ids}
+
+
+def raise_missing_post(statuses: dict[int, str], id: int, action: str):
+    """The 404 or 403 of a write that matched no row, `statuses` as returned by classify_missing."""
+    if statuses[id] == "not_found":
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Post with id {id} not found")
+    raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"You don't have permission to {action} this post")
+
+
+@router.post("/bulk", response_model=list[schemas.BulkResult])
+async def create_posts(posts: list[schemas.PostCreate], db: AsyncSession = Depends(get_db), current_user_id: int = Depends(oauth2.get_current_user_id)):
+    utils.check_bulk_size(posts)
+    if not posts:
+        return []
+    result = await db.execute(insert(models.Posts)
+                              .values([{**post.model_dump(), "owner_id": current_user_id} for post in posts])
+                              .returning(models.Posts.id, models.Posts.created_at))
+    created = result.all()
+    # ids are drawn from the sequence row by row, sorted they follow the items
+    ids = sorted(row.id for row in created)
+    await db.commit()
+    for row in created:
+        feed_index.add(row.id, row.created_at)
+    read_router.mark_write(current_user_id)
+    response_cache.invalidate_tags(POSTS_LIST_TAG)
+    return [{"id": id, "status": "created"} for id in ids]
+
+
+@router.put("/bulk", response_model=list[schemas.BulkResult])
+async def update_posts(posts: list[schemas.PostUpdate], db: AsyncSession = Depends(get_db), current_user_id: int = Depends(oauth2.get_current_user_id)):
+    utils.check_bulk_size(posts)
+    if not posts:
+        return []
+    # the last item wins when an id is listed twice
+    latest = {post.id: post for post in posts}
+    changes = values(column("id", Integer), column("title", String), column("content", String),
+                     column("published", Boolean), name="changes") \
+        .data([(post.id, post.title, post.content, post.published) for post in latest.values()])
+    result = await db.execute(update(models.Posts)
+                              .where(models.Posts.id == changes.c.id, models.Posts.owner_id == current_user_id)
+                              .values(title=changes.c.title, content=changes.c.content,
+                                      published=changes.c.published, updated_at=func.now())
+                              .returning(models.Posts.id)
+                              .execution_options(synchronize_session=False))
+    updated = set(result.scalars())
+    statuses = await classify_missing(db, [id for id in latest if id not in updated])
+    await db.commit()
+    if updated:
+        read_router.mark_write(current_user_id)
+        response_cache.invalidate_tags(POSTS_SEARCH_TAG, *(post_tag(id) for id in updated))
+    return [{"id": post.id, "status": statuses.get(post.id, "updated")} for post in posts]
+
+
+@router.post("/bulk/delete", response_model=list[schemas.BulkResult])
+async def delete_posts(ids: list[int], db: AsyncSession = Depends(get_db), current_user_id: int = Depends(oauth2.get_current_user_id)):
+    utils.check_bulk_size(ids)
+    if not ids:
+        return []
+    result = await db.execute(delete(models.Posts)
+                              .where(models.Posts.id.in_(ids), models.Posts.owner_id == current_user_id)
+                              .returning(models.Posts.id)
+                              .execution_options(synchronize_session=False))
+    deleted = set(result.scalars())
+    statuses = await classify_missing(db, [id for id in set(ids) if id not in deleted])
+    await db.commit()
+    if deleted:
+        read_router.mark_write(current_user_id)
+        response_cache.invalidate_tags(POSTS_LIST_TAG, *(post_tag(id) for id in deleted))
+        for id in deleted:
+            feed_index.remove(id)
+    return [{"id": id, "status": statuses.get(id, "deleted")} for id in ids]
+
+
+def post_validators(id: int, updated_at: datetime, vote_count: int, has_voted: bool) -> dict:
+    # the body depends on who asks, shared caches must key it on the token
+    return {**validators(post_etag(id, updated_at, vote_count, has_voted), updated_at), "Vary": "Authorization"}
+
+
 @router.get("/{id}", response_model=schemas.PostWithVote)
-async def get_post(id: int, db: Session = Depends(get_db), current_user: models.Users = Depends(oauth2.get_current_user)):
+async def get_post(id: int, request: Request, db: AsyncSession = Depends(get_read_db), current_user_id: int = Depends(oauth2.get_current_user_id)):
     # cursor.execute("SELECT * FROM posts WHERE id = %s", (str(id),))
     # post = cursor.fetchone()
-    print(current_user.id)
-    posts_with_votes = db.query(models.Posts, func.count(models.Votes.post_id) \
-                                .label("votes")).outerjoin(models.Votes) \
-                                .group_by(models.Posts.id) \
-                                .filter(models.Posts.id == id) \
-                                .first()
+    logger.debug("reading post", extra={"user_id": current_user_id, "post_id": id})
+    key = f"posts:item:{id}:{current_user_id}"
+    response = cached_response(key, request)
+    if response is not None:
+        return response
+    cache_version = response_cache.version()
+    if is_conditional(request):
+        # revalidation usually finds the post unchanged: check its version alone before loading it
+        result = await db.execute(POST_VERSION, {"id": id, "viewer_id": current_user_id})
+        version = result.first()
+        if version is not None:
+            headers = post_validators(id, version.updated_at, version.vote_count, version.has_voted)
+            if not_modified(request, headers):
+                return not_modified_response(headers)
+
+    result = await db.execute(POST_BY_ID, {"id": id, "viewer_id": current_user_id})
+    posts_with_votes = result.first()
     if posts_with_votes is None:
         raise HTTPException(status_code=404, detail=f"Post with id {id} not found")
-    return posts_with_votes
+    post = posts_with_votes.Posts
+    content = schemas.PostWithVote.model_validate(posts_with_votes).model_dump_json().encode()
+    headers = post_validators(id, post.updated_at, post.vote_count, posts_with_votes.has_voted)
+    return cache_response(key, request, content, headers, [post_tag(id)], cache_version)
 
 
 
 @router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_post(id: int, db: Session = Depends(get_db), current_user: models.Users = Depends(oauth2.get_current_user)):
+async def delete_post(id: int, db: AsyncSession = Depends(get_db), current_user_id: int = Depends(oauth2.get_current_user_id)):
     # cursor.execute("DELETE FROM posts WHERE id = %s RETURNING *", (str(id),))
     # deleted_post = cursor.fetchone()
     # conn.commit()
-    print(current_user.id)
-    deleted_post_query = db.query(models.Posts).filter(models.Posts.id == id)
-    deleted_post = deleted_post_query.first()
-    if deleted_post is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Post with id {id} not found")
-    if deleted_post.owner_id != current_user.id:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You don't have permission to delete this post")
-    deleted_post_query.delete(synchronize_session=False)
-    db.commit()
+    logger.debug("deleting post", extra={"user_id": current_user_id, "post_id": id})
+    # ownership is part of the WHERE: no window between the check and the write
+    result = await db.execute(delete(models.Posts)
+                              .where(models.Posts.id == id, models.Posts.owner_id == current_user_id)
+                              .returning(models.Posts.id)
+                              .execution_options(synchronize_session=False))
+    if result.first() is None:
+        raise_missing_post(await classify_missing(db, [id]), id, "delete")
+    await db.commit()
+    read_router.mark_write(current_user_id)
+    # later pages shift up by one, so every list goes
+    response_cache.invalidate_tags(post_tag(id), POSTS_LIST_TAG)
+    feed_index.remove(id)
 
     """here we return a response with status code 204 because conventionally when you delete something, 
     you should not return any data, you just return a status code 204. 
@@ -90,18 +504,35 @@ async def delete_post(id: int, db: Session = Depends(get_db), current_user: mode
 
 
 @router.put("/{id}", status_code=status.HTTP_200_OK, response_model=schemas.PostResponse)
-async def update_post(id: int, post: schemas.PostCreate, db: Session = Depends(get_db), current_user: models.Users = Depends(oauth2.get_current_user)):
+async def update_post(id: int, post: schemas.PostCreate, db: AsyncSession = Depends(get_db), current_user_id: int = Depends(oauth2.get_current_user_id)):
     # cursor.execute("UPDATE posts SET title = %s, content = %s, published = %s WHERE id = %s RETURNING *", 
     #                (post.title, post.content, post.published, str(id)))
     # updated_post = cursor.fetchone()
     # conn.commit()
-    print(current_user.id)
-    updated_post_query = db.query(models.Posts).filter(models.Posts.id == id)
-    updated_post = updated_post_query.first()
-    if updated_post is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Post with id {id} not found")
-    if updated_post.owner_id != current_user.id:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You don't have permission to update this post")
-    updated_post_query.update(post.dict(), synchronize_session=False)
-    db.commit()
-    return updated_post_query.first()
\ No newline at end of file
+    logger.debug("updating post", extra={"user_id": current_user_id, "post_id": id})
+    # one statement: the conditional UPDATE, and the owner joined onto what it returns
+    updated = update(models.Posts) \
+        .where(models.Posts.id == id, models.Posts.owner_id == current_user_id) \
+        .values(**post.model_dump(), updated_at=func.now()) \
+        .returning(models.Posts.id, models.Posts.title, models.Posts.content, models.Posts.published,
+                   models.Posts.created_at, models.Posts.owner_id) \
+        .cte("updated")
+    result = await db.execute(select(updated, models.Users.email.label("owner_email"),
+                                     models.Users.created_at.label("owner_created_at"))
+                              .join(models.Users, models.Users.id == updated.c.owner_id))
+    row = result.first()
+    if row is None:
+        raise_missing_post(await classify_missing(db, [id]), id, "update")
+    await db.commit()
+    read_router.mark_write(current_user_id)
+    # the new title or content can also make the post match other searches
+    response_cache.invalidate_tags(post_tag(id), POSTS_SEARCH_TAG)
+    return {
+        "title": row.title,
+        "content": row.content,
+        "published": row.published,
+        "id": row.id,
+        "created_at": row.created_at,
+        "owner_id": row.owner_id,
+        "owner": {"id": row.owner_id, "email": row.owner_email, "created_at": row.owner_created_at},
+    }
@@ -1,33 +1,49 @@
+import logging
+
 from .. import models, schemas, utils, oauth2
+from ..conditional import not_modified, not_modified_response, user_etag, validators
 from ..database import get_db
-from fastapi import FastAPI, Response, status, HTTPException, Depends, APIRouter
-from sqlalchemy.orm import Session
+from ..ratelimit import limit_per_ip
+from ..replicas import get_read_db
+from fastapi import FastAPI, Request, Response, status, HTTPException, Depends, APIRouter
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 
 router = APIRouter(
     prefix="/users",
     tags=["Users"]
 )
 
+logger = logging.getLogger(__name__)
+
 @router.get("/{id}", response_model=schemas.UserResponse)
-async def get_user(id: int, db: Session = Depends(get_db), current_user: models.Users = Depends(oauth2.get_current_user)):
-    print(current_user)
-    user = db.query(models.Users).filter(models.Users.id == id).first()
+async def get_user(id: int, request: Request, response: Response, db: AsyncSession = Depends(get_read_db), current_user_id: int = Depends(oauth2.get_current_user_id)):
+    logger.debug("reading user", extra={"user_id": current_user_id, "requested_id": id})
+    result = await db.execute(oauth2.USER_BY_ID, {"id": id})
+    user = result.scalars().first()
     if user is None:
         raise HTTPException(status_code=404, detail=f"User with id {id} not found")
+    headers = validators(user_etag(user.id, user.created_at), user.created_at)
+    if not_modified(request, headers):
+        return not_modified_response(headers)
+    response.headers.update(headers)
     return user
 
 
 
-@router.post("/", status_code=status.HTTP_201_CREATED, response_model=schemas.UserResponse)
-async def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+@router.post("/", status_code=status.HTTP_201_CREATED, response_model=schemas.UserResponse, dependencies=[Depends(limit_per_ip("signup"))])
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
     # hash user password
-    user.password = utils.hash(user.password)
+    user.password = await utils.hasher.hash(user.password)
 
-    new_user = models.Users(**user.dict())
+    new_user = models.Users(**user.model_dump())
     try:
         db.add(new_user)
-        db.commit()
-        db.refresh(new_user)
-    except:
+        await db.commit()
+        await db.refresh(new_user)
+    except IntegrityError:
+        await db.rollback()
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Email already registered")
+    # ids can come back after a restore, never serve a stale principal for them
+    oauth2.invalidate_user(new_user.id)
     return new_user
\ No newline at end of file
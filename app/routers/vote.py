@@ -1,8 +1,13 @@
-from hmac import new
-from fastapi import FastAPI, Response, status, HTTPException, Depends, APIRouter
-from sqlalchemy.orm import Session
-from app import models, oauth2, schemas
+from fastapi import Response, status, HTTPException, Depends, APIRouter
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import oauth2, schemas, utils
+from app.cache import post_tag, response_cache
+from app.config import settings
 from app.database import get_db
+from app.live import hub
+from app.ratelimit import limit_per_user, limit_user
+from app.replicas import read_router
+from app.voting import VoteRequest, apply_votes, batcher
 
 
 router = APIRouter(
@@ -10,26 +15,48 @@ router = APIRouter(
     tags=["Votes"]
 )
 
-@router.post("/", status_code=status.HTTP_201_CREATED)
-async def create_vote(vote: schemas.Vote, db: Session = Depends(get_db), current_user: models.Users = Depends(oauth2.get_current_user)):
-    post = db.query(models.Posts).filter(models.Posts.id == vote.post_id).first()
-    if not post:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Post {vote.post_id} not found")
-    
-    vote_query = db.query(models.Votes).filter(models.Votes.post_id == vote.post_id, models.Votes.user_id == current_user.id)
-    found_vote = vote_query.first()
-    print(found_vote)
-    if vote.dir == 1:
-        if found_vote:
-            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"User {current_user.id} has already voted post {vote.post_id}")
-        new_vote = models.Votes(post_id=vote.post_id, user_id=current_user.id)
-        db.add(new_vote)
-        db.commit()
-        return {"message": f"User {current_user.id} has successfully voted post {vote.post_id}"}
-        
+@router.post("/", status_code=status.HTTP_201_CREATED, dependencies=[Depends(limit_per_user("vote"))])
+async def create_vote(vote: schemas.Vote, db: AsyncSession = Depends(get_db), current_user_id: int = Depends(oauth2.get_current_user_id)):
+    request = VoteRequest(vote.post_id, current_user_id, vote.dir)
+    if settings.VOTE_BATCHING:
+        result = await batcher.submit(db, request)
     else:
-        if not found_vote:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User {current_user.id} has not voted post {vote.post_id}")
-        vote_query.delete()
-        db.commit()
-        return {"message": f"User {current_user.id} has successfully unvoted post {vote.post_id}"}
\ No newline at end of file
+        [result] = await apply_votes(db, [request])
+        await db.commit()
+
+    if result.status == "post_not_found":
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Post {vote.post_id} not found")
+    if result.status == "already_voted":
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"User {current_user_id} has already voted post {vote.post_id}")
+    if result.status == "not_voted":
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User {current_user_id} has not voted post {vote.post_id}")
+
+    read_router.mark_write(current_user_id)
+    response_cache.invalidate_tags(post_tag(vote.post_id))
+    hub.publish(vote.post_id, 1 if result.status == "voted" else -1, result.vote_count)
+    if result.status == "voted":
+        return {"message": f"User {current_user_id} has successfully voted post {vote.post_id}"}
+    return {"message": f"User {current_user_id} has successfully unvoted post {vote.post_id}"}
+
+
+@router.post("/bulk", response_model=list[schemas.BulkVoteResult])
+async def create_votes(votes: list[schemas.Vote], response: Response, db: AsyncSession = Depends(get_db), current_user_id: int = Depends(oauth2.get_current_user_id)):
+    """Votes applied in order within one transaction, each with the outcome a single POST /votes/ would have had."""
+    utils.check_bulk_size(votes)
+    limit_user("vote", current_user_id, response, cost=len(votes))
+    if not votes:
+        return []
+    results = await apply_votes(db, [VoteRequest(vote.post_id, current_user_id, vote.dir) for vote in votes])
+    await db.commit()
+    # post id -> (delta, vote_count at the end)
+    changed: dict[int, tuple[int, int]] = {}
+    for result in results:
+        if result.applied:
+            delta, _ = changed.get(result.post_id, (0, None))
+            changed[result.post_id] = (delta + (1 if result.status == "voted" else -1), result.vote_count)
+    if changed:
+        read_router.mark_write(current_user_id)
+        response_cache.invalidate_tags(*(post_tag(post_id) for post_id in changed))
+        for post_id, (delta, vote_count) in changed.items():
+            hub.publish(post_id, delta, vote_count)
+    return [{"post_id": result.post_id, "dir": result.dir, "status": result.status} for result in results]
@@ -1,9 +1,94 @@
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+from fastapi import HTTPException, status
 from passlib.context import CryptContext
 
+from app import metrics
+from app.config import settings
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 def hash(password: str):
     return pwd_context.hash(password)
 
 def verify(plain_password: str, hashed_password: str):
-    return pwd_context.verify(plain_password, hashed_password)
\ No newline at end of file
+    return pwd_context.verify(plain_password, hashed_password)
+
+def check_bulk_size(items: list):
+    if len(items) > settings.BULK_MAX_ITEMS:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"At most {settings.BULK_MAX_ITEMS} items per request, got {len(items)}")
+
+
+class PasswordHasher:
+    """
+    Runs `hash` and `verify` in a bounded worker pool.
+
+    A bcrypt call costs 100-300 ms of CPU; made from an `async def` handler it
+    freezes every other request of the worker. Here at most `workers` calls run
+    at once, `queue_size` more may wait, and anything beyond that is rejected
+    with 503 + Retry-After instead of piling up.
+    """
+
+    def __init__(self, workers: int = 4, queue_size: int = 32, pool: str = "thread", retry_after: int = 1):
+        if pool not in ("thread", "process"):
+            raise ValueError(f"Unknown password hash pool {pool!r}, expected 'thread' or 'process'")
+        self.workers = workers
+        self.queue_size = queue_size
+        self.pool = pool
+        self.retry_after = retry_after
+        self.pending = 0
+        self._executor: Optional[Executor] = None
+
+    @property
+    def saturated(self) -> bool:
+        return self.pending >= self.workers + self.queue_size
+
+    def _get_executor(self) -> Executor:
+        # created lazily so importing the app does not fork or spawn threads
+        if self._executor is None:
+            if self.pool == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        return self._executor
+
+    def _report_depth(self):
+        metrics.PASSWORD_HASH_IN_FLIGHT.set(self.pending)
+        metrics.PASSWORD_HASH_QUEUE_DEPTH.set(max(0, self.pending - self.workers))
+
+    async def _run(self, operation: str, func, *args):
+        if self.saturated:
+            metrics.PASSWORD_HASH_REJECTED.labels(operation).inc()
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail="Server is busy, please retry later",
+                                headers={"Retry-After": str(self.retry_after)})
+        self.pending += 1
+        self._report_depth()
+        start = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), func, *args)
+        finally:
+            self.pending -= 1
+            self._report_depth()
+            metrics.PASSWORD_HASH_SECONDS.labels(operation).observe(time.perf_counter() - start)
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run("verify", verify, plain_password, hashed_password)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+hasher = PasswordHasher(workers=settings.PASSWORD_HASH_WORKERS,
+                        queue_size=settings.PASSWORD_HASH_QUEUE_SIZE,
+                        pool=settings.PASSWORD_HASH_POOL,
+                        retry_after=settings.PASSWORD_HASH_RETRY_AFTER)
@@ -0,0 +1,218 @@
+"""
+Vote writes. Every vote, alone or in a batch, is applied by one statement that
+inserts or deletes the votes rows, moves posts.vote_count with them and reports
+the outcome of each vote.
+"""
+
+import asyncio
+import time
+from typing import NamedTuple, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import metrics
+from app.config import settings
+
+
+class VoteRequest(NamedTuple):
+    post_id: int
+    user_id: int
+    dir: int
+
+
+class VoteResult(NamedTuple):
+    post_id: int
+    user_id: int
+    dir: int
+    # "voted", "unvoted", "already_voted", "not_voted" or "post_not_found"
+    status: str
+    # posts.vote_count once the statement ran, None when it did not move
+    vote_count: Optional[int] = None
+
+    @property
+    def applied(self) -> bool:
+        return self.status in ("voted", "unvoted")
+
+
+# The posts of the batch are locked in id order before anything else, so that two
+# batches touching the same posts queue up instead of deadlocking. Postgres orders
+# data-modifying CTEs only by what they read, so both writes join `locked`. Votes on a missing
+# post are filtered by that join rather than failing the whole batch on the foreign key.
+# `bumped` must stay out of the final SELECT: postgres then runs it last, once `locked`
+# holds its locks, rather than as soon as the SELECT reads it. The new vote_count is
+# worked out from the locked rows instead, which no other transaction can move.
+APPLY_VOTES = text("""
+WITH input AS (
+    SELECT * FROM unnest(CAST(:post_ids AS integer[]), CAST(:user_ids AS integer[]), CAST(:dirs AS integer[]))
+        AS input(post_id, user_id, dir)
+),
+locked AS (
+    SELECT id, vote_count FROM posts WHERE id IN (SELECT post_id FROM input) ORDER BY id FOR UPDATE
+),
+inserted AS (
+    INSERT INTO votes (post_id, user_id)
+    SELECT input.post_id, input.user_id FROM input JOIN locked ON locked.id = input.post_id
+    WHERE input.dir = 1
+    ON CONFLICT DO NOTHING
+    RETURNING post_id, user_id
+),
+deleted AS (
+    -- joined to locked only for the ordering: the votes rows are locked after the posts
+    DELETE FROM votes USING input JOIN locked ON locked.id = input.post_id
+    WHERE input.dir = 0 AND votes.post_id = input.post_id AND votes.user_id = input.user_id
+    RETURNING votes.post_id, votes.user_id
+),
+counted AS (
+    SELECT post_id, sum(delta) AS delta FROM (
+        SELECT post_id, 1 AS delta FROM inserted
+        UNION ALL
+        SELECT post_id, -1 FROM deleted
+    ) AS changes
+    GROUP BY post_id
+),
+bumped AS (
+    UPDATE posts SET vote_count = posts.vote_count + counted.delta, updated_at = now()
+    FROM counted WHERE posts.id = counted.post_id
+)
+SELECT input.post_id, input.user_id, input.dir,
+       inserted.post_id IS NOT NULL OR deleted.post_id IS NOT NULL AS applied,
+       locked.id IS NOT NULL AS post_exists,
+       locked.vote_count + counted.delta AS vote_count
+FROM input
+LEFT JOIN locked ON locked.id = input.post_id
+LEFT JOIN counted ON counted.post_id = input.post_id
+LEFT JOIN inserted ON inserted.post_id = input.post_id AND inserted.user_id = input.user_id
+LEFT JOIN deleted ON deleted.post_id = input.post_id AND deleted.user_id = input.user_id
+""")
+
+
+def vote_status(dir: int, applied: bool, post_exists: bool) -> str:
+    if not post_exists:
+        return "post_not_found"
+    if dir == 1:
+        return "voted" if applied else "already_voted"
+    return "unvoted" if applied else "not_voted"
+
+
+def plan_rounds(votes: list[VoteRequest]) -> list[list[int]]:
+    """
+    Indexes of `votes` split into rounds holding each (post, user) at most once, in
+    arrival order: voting twice in one batch must conflict exactly as it would in
+    two requests.
+    """
+    rounds: list[list[int]] = []
+    seen: dict[tuple[int, int], int] = {}
+    for index, vote in enumerate(votes):
+        key = (vote.post_id, vote.user_id)
+        round_number = seen.get(key, -1) + 1
+        seen[key] = round_number
+        if round_number == len(rounds):
+            rounds.append([])
+        rounds[round_number].append(index)
+    return rounds
+
+
+async def apply_votes(db: AsyncSession, votes: list[VoteRequest]) -> list[VoteResult]:
+    """Apply `votes` in order, one statement per round, without committing."""
+    results: list[Optional[VoteResult]] = [None] * len(votes)
+    for indexes in plan_rounds(votes):
+        batch = [votes[index] for index in indexes]
+        rows = await db.execute(APPLY_VOTES, {
+            "post_ids": [vote.post_id for vote in batch],
+            "user_ids": [vote.user_id for vote in batch],
+            "dirs": [vote.dir for vote in batch],
+        })
+        # keys are unique within a round
+        outcome = {(row.post_id, row.user_id): row for row in rows}
+        for index, vote in zip(indexes, batch):
+            row = outcome[(vote.post_id, vote.user_id)]
+            results[index] = VoteResult(*vote, vote_status(vote.dir, row.applied, row.post_exists), row.vote_count)
+    return results
+
+
+class _Batch:
+    def __init__(self):
+        self.votes: list[VoteRequest] = []
+        self.futures: list[asyncio.Future] = []
+        self.full = asyncio.Event()
+
+
+class VoteBatcher:
+    """
+    Coalesces concurrent votes into one statement and one commit. The first vote
+    of a batch leads it: it waits up to `max_delay` seconds or until `max_size`
+    votes joined, then writes them all with its own session. Every caller gets the
+    result of its own vote, so conflicts are still reported per request.
+    """
+
+    def __init__(self, max_size: int = 100, max_delay: float = 0.01):
+        self.max_size = max_size
+        self.max_delay = max_delay
+        # one open batch per event loop, a batch never mixes futures of two loops
+        self._open: dict[asyncio.AbstractEventLoop, _Batch] = {}
+
+    def _close(self, loop, batch: _Batch):
+        if self._open.get(loop) is batch:
+            del self._open[loop]
+
+    async def submit(self, db: AsyncSession, vote: VoteRequest) -> VoteResult:
+        loop = asyncio.get_running_loop()
+        batch = self._open.get(loop)
+        leader = batch is None
+        if leader:
+            batch = self._open[loop] = _Batch()
+        future = loop.create_future()
+        batch.votes.append(vote)
+        batch.futures.append(future)
+        if len(batch.votes) >= self.max_size:
+            self._close(loop, batch)
+            batch.full.set()
+        if not leader:
+            return await future
+
+        # the flush belongs to no request: a cancelled leader or follower must not strand the others
+        flush = loop.create_task(self._flush(loop, db, batch))
+        cancelled = False
+        while not flush.done():
+            try:
+                await asyncio.shield(flush)
+            except asyncio.CancelledError:
+                # the batch is written with this request's session, keep it until the flush is over
+                cancelled = True
+        if cancelled:
+            raise asyncio.CancelledError
+        return await future
+
+    async def _flush(self, loop, db: AsyncSession, batch: _Batch):
+        """Write `batch` and settle each of its futures that is still awaited."""
+        error: Optional[BaseException] = None
+        try:
+            try:
+                await asyncio.wait_for(batch.full.wait(), self.max_delay)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self._close(loop, batch)
+            started = time.perf_counter()
+            results = await apply_votes(db, batch.votes)
+            await db.commit()
+            metrics.VOTE_BATCH_SIZE.observe(len(batch.votes))
+            metrics.VOTE_BATCH_SECONDS.observe(time.perf_counter() - started)
+        except BaseException as exc:
+            error = exc
+        for index, future in enumerate(batch.futures):
+            if future.done():
+                # its request was cancelled
+                continue
+            if error is None:
+                future.set_result(results[index])
+            elif isinstance(error, Exception):
+                future.set_exception(error)
+            else:
+                future.cancel()
+        if error is not None and not isinstance(error, Exception):
+            raise error
+
+
+batcher = VoteBatcher(max_size=settings.VOTE_BATCH_SIZE, max_delay=settings.VOTE_BATCH_DELAY_MS / 1000)
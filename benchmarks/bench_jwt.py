@@ -0,0 +1,64 @@
+"""
+Cold vs warm cost of oauth2.verify_access_token for HS256 and RS256.
+
+python -m benchmarks.bench_jwt
+python -m benchmarks.bench_jwt --iterations 20000
+
+Cold: the token cache is cleared before every call, so each call runs the
+full jwt.decode. Warm: the same token is verified again and again, the way
+a client polling the API sends it.
+"""
+
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwt
+
+from app import oauth2
+
+
+def rsa_keys():
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    public_pem = private_key.public_key().public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo)
+    return private_pem.decode(), public_pem.decode()
+
+
+def time_per_call(func, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations
+
+
+def bench(algorithm: str, signing_key: str, verifying_key: str, iterations: int):
+    token = jwt.encode({"user_id": 1, "exp": datetime.utcnow() + timedelta(hours=1)}, signing_key, algorithm=algorithm)
+    oauth2.SECRET_KEY, oauth2.ALGORITHM = verifying_key, algorithm
+    credentials_exception = oauth2.get_credentials_exception()
+
+    def cold():
+        oauth2.token_cache.clear()
+        oauth2.verify_access_token(token, credentials_exception)
+
+    def warm():
+        oauth2.verify_access_token(token, credentials_exception)
+
+    cold_s = time_per_call(cold, iterations)
+    oauth2.token_cache.clear()
+    warm_s = time_per_call(warm, iterations)
+    print(f"{algorithm}: cold {cold_s * 1e6:8.1f} us  warm {warm_s * 1e6:6.1f} us  "
+          f"speedup x{cold_s / warm_s:.0f}  hit rate {oauth2.token_cache.hit_rate:.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args()
+
+    secret = "bench-secret-key-bench-secret-key"
+    bench("HS256", secret, secret, args.iterations)
+    private_pem, public_pem = rsa_keys()
+    bench("RS256", private_pem, public_pem, args.iterations)
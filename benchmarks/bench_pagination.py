@@ -0,0 +1,75 @@
+"""
+Latency of GET /posts at page 1 vs page 10,000: offset paging vs cursor paging.
+
+python -m benchmarks.bench_pagination --posts 1000000
+python -m benchmarks.bench_pagination --no-seed          # reuse the last seeded data
+
+Runs the exact statements the endpoint builds (select_posts_page) against the
+test database of tests/conftest.py, which is reseeded first.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app import models
+from app.pagination import encode_cursor
+from app.routers.post import select_posts_page
+from benchmarks.seed import default_url, seed_database
+
+
+# has_voted is computed for this seeded user
+VIEWER_ID = 1
+
+
+async def median_ms(conn, statement, repeat: int, parameters: Optional[dict] = None) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        (await conn.execute(statement, parameters)).all()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+async def main(args):
+    url = args.url or default_url()
+    if not args.no_seed:
+        print(seed_database(url, users=args.users, posts=args.posts, votes_per_post=1))
+
+    engine = create_async_engine(url.replace("postgresql://", "postgresql+asyncpg://", 1))
+    async with engine.connect() as conn:
+        skip = args.limit * (args.page - 1)
+        # the cursor a client holds after walking to the page before
+        last_seen = (await conn.execute(
+            select(models.Posts.created_at, models.Posts.id)
+            .order_by(models.Posts.created_at.desc(), models.Posts.id.desc())
+            .offset(skip - 1).limit(1)
+        )).one()
+        cursor = encode_cursor(last_seen.created_at, last_seen.id)
+
+        cases = {
+            "offset page 1": select_posts_page(args.limit, VIEWER_ID, skip=0),
+            f"offset page {args.page}": select_posts_page(args.limit, VIEWER_ID, skip=skip),
+            "cursor page 1": select_posts_page(args.limit, VIEWER_ID),
+            f"cursor page {args.page}": select_posts_page(args.limit, VIEWER_ID, cursor=cursor),
+        }
+        for name, (statement, parameters) in cases.items():
+            print(f"{name:>22}: {await median_ms(conn, statement, args.repeat, parameters):8.2f} ms")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="sync SQLAlchemy url, defaults to the test database")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--posts", type=int, default=1000000)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--page", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--no-seed", action="store_true")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,49 @@
+"""
+GET /posts?search=... : the old title LIKE '%...%' filter vs full-text search on search_vector.
+
+python -m benchmarks.bench_search --posts 1000000
+python -m benchmarks.bench_search --no-seed --search vacuum --search "postgres replica"
+
+Runs against the test database of tests/conftest.py, which is reseeded first.
+"""
+
+import argparse
+import asyncio
+
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app import models
+from app.routers.post import select_posts_page, select_posts_with_votes
+from benchmarks.bench_pagination import VIEWER_ID, median_ms
+from benchmarks.seed import default_url, seed_database
+
+
+async def main(args):
+    url = args.url or default_url()
+    if not args.no_seed:
+        print(seed_database(url, users=args.users, posts=args.posts, votes_per_post=1))
+
+    engine = create_async_engine(url.replace("postgresql://", "postgresql+asyncpg://", 1))
+    async with engine.connect() as conn:
+        for search in args.search:
+            like = select_posts_with_votes() \
+                .where(models.Posts.title.contains(search)) \
+                .limit(args.limit)
+            fts, fts_parameters = select_posts_page(args.limit, VIEWER_ID, search=search)
+            print(f"{search!r:>22}: like {await median_ms(conn, like, args.repeat, {'viewer_id': VIEWER_ID}):8.2f} ms"
+                  f"   full-text {await median_ms(conn, fts, args.repeat, fts_parameters):8.2f} ms")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="sync SQLAlchemy url, defaults to the test database")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--posts", type=int, default=1000000)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--search", action="append", help="may be repeated")
+    parser.add_argument("--no-seed", action="store_true")
+    args = parser.parse_args()
+    args.search = args.search or ["vacuum", "postgres replica", "post 99999", "nothing matches"]
+    asyncio.run(main(args))
@@ -0,0 +1,79 @@
+"""
+Serialization cost of one GET /posts page of 100 posts, no database involved.
+
+python -m benchmarks.bench_serialization
+python -m benchmarks.bench_serialization --posts 100 --iterations 2000
+
+before:       FastAPI response_model validation + JSONResponse (json.dumps), the old default
+orjson:       same validation, ORJSONResponse, the new app default
+type adapter: PostWithVoteList validates the ORM rows and dumps json bytes directly
+core rows:    POSTS_ROW_SERIALIZATION, flat Core rows -> dicts -> orjson
+"""
+
+import argparse
+import asyncio
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+import orjson
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+
+from app import models, schemas
+from app.routers.post import post_row_to_dict
+
+OrmRow = namedtuple("OrmRow", ["Posts", "votes", "has_voted"])
+CoreRow = namedtuple("CoreRow", ["id", "title", "content", "published", "created_at", "owner_id", "votes",
+                                 "owner_email", "owner_created_at", "has_voted"])
+
+
+def make_rows(count: int):
+    now = datetime.now(timezone.utc)
+    owner = models.Users(id=1, email="owner@gmail.com", created_at=now)
+    orm_rows, core_rows = [], []
+    for i in range(count):
+        created_at = now - timedelta(seconds=i)
+        post = models.Posts(id=i, title=f"post {i}", content=f"content of post {i} " * 10, published=True,
+                            created_at=created_at, owner_id=owner.id, owner=owner)
+        orm_rows.append(OrmRow(post, i % 7, i % 2 == 0))
+        core_rows.append(CoreRow(i, post.title, post.content, True, created_at, owner.id, i % 7,
+                                 owner.email, owner.created_at, i % 2 == 0))
+    return orm_rows, core_rows
+
+
+def per_call_us(func, iterations: int) -> float:
+    func()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main(args):
+    orm_rows, core_rows = make_rows(args.posts)
+    field = create_model_field(name="Response_get_posts", type_=list[schemas.PostWithVote], mode="serialization")
+    loop = asyncio.new_event_loop()
+
+    def fastapi_content():
+        return loop.run_until_complete(serialize_response(field=field, response_content=orm_rows, is_coroutine=True))
+
+    cases = {
+        "before": lambda: JSONResponse(fastapi_content()).body,
+        "orjson": lambda: ORJSONResponse(fastapi_content()).body,
+        "type adapter": lambda: schemas.PostWithVoteList.dump_json(schemas.PostWithVoteList.validate_python(orm_rows)),
+        "core rows": lambda: orjson.dumps([post_row_to_dict(row) for row in core_rows], option=orjson.OPT_UTC_Z),
+    }
+    baseline = None
+    for name, func in cases.items():
+        us = per_call_us(func, args.iterations)
+        baseline = baseline or us
+        print(f"{name:>13}: {us:9.1f} us per {args.posts} posts   x{baseline / us:.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--posts", type=int, default=100)
+    parser.add_argument("--iterations", type=int, default=500)
+    main(parser.parse_args())
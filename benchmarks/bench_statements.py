@@ -0,0 +1,107 @@
+"""
+Python-side cost of the hot statements: rebuilt on every request (before) vs
+built once with bound parameters (after).
+
+python -m benchmarks.bench_statements                  # no database involved
+python -m benchmarks.bench_statements --execute        # also time execution against the seeded test database
+python -m benchmarks.bench_statements --execute --no-seed --iterations 5000
+
+build + key: what a request pays before SQLAlchemy can even look in its compiled
+             cache: constructing the statement and computing its cache key. A
+             statement built once keeps its key, so "after" is the lookup alone.
+execute:     the whole `await session.execute(...)` of one row (median), against
+             postgres on this machine; the difference is the part spent in Python.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from app import models, oauth2
+from app.routers.auth import USER_BY_EMAIL
+from app.routers.post import POST_BY_ID, POST_VERSION, has_voted, select_posts_page, select_posts_with_votes
+from benchmarks.seed import default_url, seed_database
+
+
+def old_page(limit: int):
+    return select_posts_with_votes().limit(limit) \
+        .order_by(models.Posts.created_at.desc(), models.Posts.id.desc())
+
+
+# name -> (statement as it used to be built per request, (statement built once, parameters))
+CASES = {
+    "get_post": (lambda: select_posts_with_votes().where(models.Posts.id == 1),
+                 lambda: (POST_BY_ID, {"id": 1, "viewer_id": 1})),
+    "post version": (lambda: select(models.Posts.updated_at, models.Posts.vote_count, has_voted()).where(models.Posts.id == 1),
+                     lambda: (POST_VERSION, {"id": 1, "viewer_id": 1})),
+    "get_posts page": (lambda: old_page(10),
+                       lambda: select_posts_page(10, 1)),
+    "current user": (lambda: select(models.Users).where(models.Users.id == 1),
+                     lambda: (oauth2.USER_BY_ID, {"id": 1})),
+    "login user": (lambda: select(models.Users).where(models.Users.email == "user1@bench.local"),
+                   lambda: (USER_BY_EMAIL, {"email": "user1@bench.local"})),
+}
+
+
+def per_call_us(func, iterations: int) -> float:
+    func()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1_000_000
+
+
+async def median_execute_us(session: AsyncSession, make, iterations: int) -> float:
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        statement, parameters = make()
+        (await session.execute(statement, parameters)).all()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1_000_000
+
+
+async def execute_cases(url: str, iterations: int) -> dict:
+    engine = create_async_engine(url.replace("postgresql://", "postgresql+asyncpg://", 1))
+    results = {}
+    try:
+        async with AsyncSession(engine) as session:
+            for name, (before, after) in CASES.items():
+                results[name] = (await median_execute_us(session, lambda: (before(), {"viewer_id": 1}), iterations),
+                                 await median_execute_us(session, after, iterations))
+    finally:
+        await engine.dispose()
+    return results
+
+
+def main(args):
+    print(f"{'':>16}  {'build + key (us)':>22}  " + (f"{'execute (us)':>22}" if args.execute else ""))
+    executed = {}
+    if args.execute:
+        url = args.url or default_url()
+        if not args.no_seed:
+            print(seed_database(url, users=args.users, posts=args.posts, votes_per_post=1))
+        executed = asyncio.run(execute_cases(url, args.iterations))
+    for name, (before, after) in CASES.items():
+        statement, _ = after()
+        built = (per_call_us(lambda: before()._generate_cache_key(), args.iterations),
+                 per_call_us(lambda: statement._generate_cache_key(), args.iterations))
+        line = f"{name:>16}  {built[0]:9.1f} -> {built[1]:9.1f}"
+        if name in executed:
+            line += f"  {executed[name][0]:9.1f} -> {executed[name][1]:9.1f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--execute", action="store_true", help="also execute the statements")
+    parser.add_argument("--url", help="sync SQLAlchemy url, defaults to the test database")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--posts", type=int, default=10000)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--no-seed", action="store_true")
+    main(parser.parse_args())
@@ -0,0 +1,248 @@
+"""
+Load test of the real routes against a freshly seeded, throwaway database.
+
+python -m benchmarks.load_test --output results/$(git rev-parse --short HEAD).json
+python -m benchmarks.load_test --posts 1000000 --concurrency 8 64 --duration 30 --workers 4
+python -m benchmarks.load_test --compare results/base.json --output results/new.json
+
+By default the test database of tests/conftest.py is seeded (see benchmarks.seed,
+it is dropped and recreated) and the app is started on it with uvicorn in a
+subprocess. The app relies on postgres (full-text search, arrays, ON CONFLICT),
+so the database has to be a postgres one; any local or disposable instance does.
+Pass --server-url to drive an app that is already running on the seeded database.
+
+Every client logs in as its own seeded user, then keeps picking one of the
+operations below at random, weighted by --mix. Each concurrency level reports
+requests per second and p50/p95/p99 per operation. The json written by --output
+records the commit and the parameters, so runs on two commits can be compared
+with --compare.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+import httpx
+from sqlalchemy.engine import make_url
+
+from benchmarks.seed import BENCH_PASSWORD, VOCABULARY, default_url, seed_database
+from benchmarks.throughput import summarize
+
+OPERATIONS = ["list", "search", "page", "get", "vote"]
+DEFAULT_MIX = {"list": 30, "search": 15, "page": 15, "get": 30, "vote": 10}
+
+
+class Client:
+    """One simulated user, with its own connection and token."""
+
+    def __init__(self, http: httpx.AsyncClient, number: int, posts: int, rng: random.Random):
+        self.http = http
+        self.number = number
+        self.posts = posts
+        self.rng = rng
+        self.cursor: Optional[str] = None
+        self.voted: set[int] = set()
+
+    async def login(self):
+        res = await self.http.post("/login", data={"username": f"user{self.number}@bench.local", "password": BENCH_PASSWORD})
+        res.raise_for_status()
+        self.http.headers["Authorization"] = f"Bearer {res.json()['access_token']}"
+        return res
+
+    async def list(self):
+        return await self.http.get("/posts/", params={"limit": 10})
+
+    async def search(self):
+        return await self.http.get("/posts/", params={"limit": 10, "search": self.rng.choice(VOCABULARY)})
+
+    async def page(self):
+        # walks down the listing, one page further each time
+        params = {"limit": 10, "cursor": self.cursor} if self.cursor else {"limit": 10}
+        res = await self.http.get("/posts/", params=params)
+        self.cursor = res.headers.get("X-Next-Cursor")
+        return res
+
+    async def get(self):
+        return await self.http.get(f"/posts/{self.rng.randint(1, self.posts)}")
+
+    async def vote(self):
+        # toggles: votes a post it has not voted yet, or takes a vote back
+        if self.voted and self.rng.random() < 0.5:
+            post_id = self.voted.pop()
+            return await self.http.post("/votes/", json={"post_id": post_id, "dir": 0})
+        post_id = self.rng.randint(1, self.posts)
+        res = await self.http.post("/votes/", json={"post_id": post_id, "dir": 1})
+        if res.status_code == 201:
+            self.voted.add(post_id)
+        return res
+
+
+async def run_level(url: str, concurrency: int, duration: float, mix: dict, users: int, posts: int, seed: int) -> dict:
+    latencies: dict[str, list[float]] = {name: [] for name in ["login", *OPERATIONS]}
+    errors: dict[str, int] = {name: 0 for name in latencies}
+    operations, weights = zip(*mix.items())
+
+    async def timed(name, call):
+        start = time.perf_counter()
+        try:
+            res = await call()
+            failed = res.status_code >= 500 or (res.status_code >= 400 and name != "vote")
+        except httpx.HTTPError:
+            failed = True
+        latencies[name].append(time.perf_counter() - start)
+        errors[name] += failed
+
+    async with contextlib.AsyncExitStack() as stack:
+        clients = []
+        for number in range(concurrency):
+            http = await stack.enter_async_context(httpx.AsyncClient(base_url=url, timeout=60))
+            clients.append(Client(http, 1 + number % users, posts, random.Random(seed * 100_000 + number)))
+
+        # logins are bcrypt bound, they get a phase of their own instead of eating into the duration
+        start = time.perf_counter()
+        await asyncio.gather(*(timed("login", client.login) for client in clients))
+        login_elapsed = time.perf_counter() - start
+
+        async def worker(client: Client, deadline: float):
+            while time.perf_counter() < deadline:
+                name = client.rng.choices(operations, weights)[0]
+                await timed(name, getattr(client, name))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client, start + duration) for client in clients))
+        elapsed = time.perf_counter() - start
+
+    total = [latency for name in OPERATIONS for latency in latencies[name]]
+    return {
+        "concurrency": concurrency,
+        **summarize(total, elapsed),
+        "errors": sum(errors.values()),
+        "operations": {
+            "login": {**summarize(latencies["login"], login_elapsed), "errors": errors["login"]},
+            **{name: {**summarize(latencies[name], elapsed), "errors": errors[name]} for name in OPERATIONS},
+        },
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(database_url: str, workers: int) -> tuple[subprocess.Popen, str]:
+    """uvicorn serving the app on `database_url`, the other settings come from the environment / .env."""
+    database = make_url(database_url)
+    env = {
+        **os.environ,
+        "DATABASE_HOSTNAME": database.host or "localhost",
+        "DATABASE_PORT": str(database.port or 5432),
+        "DATABASE_USERNAME": database.username or "",
+        "DATABASE_PASSWORD": database.password or "",
+        "DATABASE_NAME": database.database,
+        "LOG_LEVEL": "WARNING",
+        # every client comes from 127.0.0.1 and votes far more than a person would
+        "RATE_LIMIT_ENABLED": "false",
+    }
+    port = free_port()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port),
+                               "--workers", str(workers), "--log-level", "warning"], env=env)
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            httpx.get(url + "/", timeout=1)
+            return server, url
+        except httpx.HTTPError:
+            if server.poll() is not None:
+                raise RuntimeError("the app exited during startup")
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError(f"the app did not answer on {url}")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous: dict, current: dict):
+    """Print rps and p95 of every level and operation next to those of an earlier run."""
+    before = {level["concurrency"]: level for level in previous["levels"]}
+    for level in current["levels"]:
+        old = before.get(level["concurrency"])
+        if old is None:
+            continue
+        for name in ["all", "login", *OPERATIONS]:
+            new_stats = level if name == "all" else level["operations"][name]
+            old_stats = old if name == "all" else old["operations"].get(name)
+            if not old_stats or not old_stats["requests"] or not new_stats["requests"]:
+                continue
+            print(f"c={level['concurrency']:<4} {name:<7} "
+                  f"rps {old_stats['rps']:>9} -> {new_stats['rps']:<9} "
+                  f"p95 {old_stats['p95_ms']:>9} -> {new_stats['p95_ms']} ms")
+
+
+def main(args):
+    mix = {name: weight for name, weight in (item.split("=") for item in args.mix)} if args.mix else DEFAULT_MIX
+    mix = {name: float(weight) for name, weight in mix.items()}
+    if unknown := set(mix) - set(OPERATIONS):
+        raise SystemExit(f"unknown operations in --mix: {sorted(unknown)}, expected some of {OPERATIONS}")
+
+    database_url = args.database_url or default_url()
+    seeded = None if args.no_seed else seed_database(database_url, args.users, args.posts, args.votes_per_post)
+    server, url = (None, args.server_url) if args.server_url else start_server(database_url, args.workers)
+    try:
+        levels = []
+        for concurrency in args.concurrency:
+            level = asyncio.run(run_level(url, concurrency, args.duration, mix, args.users, args.posts, args.seed))
+            print(json.dumps({key: value for key, value in level.items() if key != "operations"}))
+            levels.append(level)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "parameters": {"users": args.users, "posts": args.posts, "votes_per_post": args.votes_per_post,
+                       "duration": args.duration, "workers": args.workers, "mix": mix, "seed": args.seed},
+        "seeded": seeded,
+        "levels": levels,
+    }
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="sync SQLAlchemy url of the database to seed, defaults to the test database")
+    parser.add_argument("--server-url", help="drive this running app instead of starting one")
+    parser.add_argument("--no-seed", action="store_true", help="keep the data of a previous run")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--posts", type=int, default=100000)
+    parser.add_argument("--votes-per-post", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--mix", nargs="+", metavar="OPERATION=WEIGHT", help=f"default: {DEFAULT_MIX}")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the clients")
+    parser.add_argument("--output", help="write the results as json to this file")
+    parser.add_argument("--compare", help="json of an earlier run to compare with")
+    main(parser.parse_args())
@@ -0,0 +1,81 @@
+"""
+Seed a throwaway database with users, posts and votes using set-based inserts.
+
+python -m benchmarks.seed --posts 1000000
+python -m benchmarks.seed --users 1000 --posts 100000 --votes-per-post 5 --url postgresql://...
+
+Defaults to the test database of tests/conftest.py; the tables there are
+dropped and recreated, never point this at a database you care about.
+"""
+
+import argparse
+import time
+
+from sqlalchemy import create_engine, text
+
+from app import models, utils
+from app.database import Base
+
+BENCH_PASSWORD = "bench"
+VOCABULARY = [
+    "fastapi", "postgres", "python", "asyncio", "pydantic", "sqlalchemy", "uvicorn", "docker", "nginx",
+    "alembic", "pytest", "bcrypt", "jwt", "cursor", "index", "vacuum", "replica", "cache", "benchmark",
+]
+
+
+def default_url() -> str:
+    from tests.conftest import SQLALCHEMY_DATABASE_URL
+    return SQLALCHEMY_DATABASE_URL
+
+
+def seed_database(url: str, users: int = 1000, posts: int = 100000, votes_per_post: int = 3) -> dict:
+    """Recreate the schema and fill it. Users are user{n}@bench.local with password `bench`."""
+    engine = create_engine(url)
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO users (email, password) "
+            "SELECT 'user' || g || '@bench.local', :password FROM generate_series(1, :users) AS g"
+        ), {"password": utils.hash(BENCH_PASSWORD), "users": users})
+        # one post per second going back in time, spread round robin over the users,
+        # titles and contents mix in words from a small vocabulary for the search benchmarks
+        conn.execute(text(
+            "INSERT INTO posts (title, content, owner_id, created_at) "
+            "SELECT 'post ' || g || ' ' || (:words)[1 + g % 7] || ' ' || (:words)[1 + g % 11], "
+            "       'content of post ' || g || ' about ' || (:words)[1 + g % 13] || ' and ' || (:words)[1 + g % 17], "
+            "       1 + g % :users, now() - make_interval(secs => g) "
+            "FROM generate_series(1, :posts) AS g"
+        ), {"users": users, "posts": posts, "words": VOCABULARY})
+        # between 0 and 2 * votes_per_post votes per post, from distinct users
+        conn.execute(text(
+            "INSERT INTO votes (post_id, user_id) "
+            "SELECT p, 1 + (p + v) % :users "
+            "FROM generate_series(1, :posts) AS p, generate_series(1, LEAST(:users, 2 * :votes_per_post)) AS v "
+            "WHERE v <= p % (2 * :votes_per_post + 1) "
+            "ON CONFLICT DO NOTHING"
+        ), {"users": users, "posts": posts, "votes_per_post": votes_per_post})
+        # the denormalized counter and version the app maintains on every vote
+        conn.execute(text(
+            "UPDATE posts SET vote_count = counted.votes, updated_at = posts.created_at "
+            "FROM (SELECT post_id, count(*) AS votes FROM votes GROUP BY post_id) AS counted "
+            "WHERE posts.id = counted.post_id"
+        ))
+    with engine.connect() as conn:
+        conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("ANALYZE"))
+        counts = {table: conn.execute(text(f"SELECT count(*) FROM {table}")).scalar()
+                  for table in (models.Users.__tablename__, models.Posts.__tablename__, models.Votes.__tablename__)}
+    engine.dispose()
+    counts["seconds"] = round(time.perf_counter() - started, 2)
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="sync SQLAlchemy url, defaults to the test database")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--posts", type=int, default=100000)
+    parser.add_argument("--votes-per-post", type=int, default=3)
+    args = parser.parse_args()
+    print(seed_database(args.url or default_url(), args.users, args.posts, args.votes_per_post))
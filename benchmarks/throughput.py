@@ -0,0 +1,89 @@
+"""
+Throughput vs concurrency against a running server.
+
+Start the app the way it is deployed (see gunicorn.service), once on the
+commit before the async database path and once on this one, then run:
+
+python -m benchmarks.throughput --url http://localhost:8000 --email bench@gmail.com --password bench
+python -m benchmarks.throughput --url http://localhost:8000 --email bench@gmail.com --password bench --path "/posts/?limit=10" --concurrency 1 8 32 128
+
+The user is created if it does not exist yet. Every concurrency level runs for
+--duration seconds and reports requests per second and latency percentiles.
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import httpx
+
+
+async def get_token(client: httpx.AsyncClient, email: str, password: str) -> str:
+    await client.post("/users/", json={"email": email, "password": password})
+    res = await client.post("/login", data={"username": email, "password": password})
+    res.raise_for_status()
+    return res.json()["access_token"]
+
+
+async def run_level(client: httpx.AsyncClient, path: str, concurrency: int, duration: float) -> dict:
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            res = await client.get(path)
+            latencies.append(time.perf_counter() - start)
+            if res.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {"concurrency": concurrency, **summarize(latencies, elapsed), "errors": errors}
+
+
+def summarize(latencies: list[float], elapsed: float) -> dict:
+    """Request count, requests per second and latency percentiles of `latencies` (seconds) measured over `elapsed`."""
+    if not latencies:
+        return {"requests": 0, "rps": 0.0, "p50_ms": None, "p95_ms": None, "p99_ms": None}
+    latencies = sorted(latencies)
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {
+        "requests": len(latencies),
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(quantiles[49] * 1000, 2),
+        "p95_ms": round(quantiles[94] * 1000, 2),
+        "p99_ms": round(quantiles[98] * 1000, 2),
+    }
+
+
+async def main(args):
+    limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=60) as client:
+        token = await get_token(client, args.email, args.password)
+        client.headers["Authorization"] = f"Bearer {token}"
+        results = []
+        for concurrency in args.concurrency:
+            result = await run_level(client, args.path, concurrency, args.duration)
+            print(json.dumps(result))
+            results.append(result)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"url": args.url, "path": args.path, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--path", default="/posts/")
+    parser.add_argument("--email", default="bench@gmail.com")
+    parser.add_argument("--password", default="bench")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64, 128])
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--output", help="write the results as json to this file")
+    asyncio.run(main(parser.parse_args()))
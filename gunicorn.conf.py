@@ -0,0 +1,11 @@
+"""
+Read by gunicorn from the working directory. With PROMETHEUS_MULTIPROC_DIR set
+(gunicorn.service does), the workers write their metrics to that directory and
+/metrics aggregates them; the directory must be emptied before gunicorn starts.
+"""
+from prometheus_client import multiprocess
+
+
+def child_exit(server, worker):
+    # drop the live gauges of a dead worker, its counters and histograms stay counted
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,50 +1,190 @@
+import os
+from contextlib import contextmanager
 from venv import create
 import pytest
 from fastapi.testclient import TestClient
 
+# off by default (see config.py); the suite runs in one process, where "local" is exact
+os.environ.setdefault("RESPONSE_CACHE_BACKEND", "local")
+
 from app.main import app
 from app.config import settings
 from app.database import get_db, Base
-from app.oauth2 import create_access_token
-from app import models
+from app.instrumentation import instrument_engine
+from app.cache import response_cache
+from app.oauth2 import create_access_token, principal_cache, token_cache
+from app import ratelimit
+from app.feeds import feed_index
+from app import models, utils
+
+from sqlalchemy import create_engine, event, select, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession, create_async_engine
+from sqlalchemy.pool import NullPool
+
+
+# one database per pytest-xdist worker (`pytest -n 4`), so that workers never share rows
+XDIST_WORKER = os.environ.get("PYTEST_XDIST_WORKER", "")
+TEST_DATABASE_NAME = f"{settings.DATABASE_NAME}_test" + (f"_{XDIST_WORKER}" if XDIST_WORKER else "")
+SERVER_URL = f"postgresql://{settings.DATABASE_USERNAME}:{settings.DATABASE_PASSWORD}@{settings.DATABASE_HOSTNAME}:{settings.DATABASE_PORT}"
+SQLALCHEMY_DATABASE_URL = f"{SERVER_URL}/{TEST_DATABASE_NAME}"
+ASYNC_SQLALCHEMY_DATABASE_URL = SQLALCHEMY_DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
+
+# the sync engine only creates the schema, once per run
+engine = create_engine(SQLALCHEMY_DATABASE_URL)
+
+# the app talks to the test database through asyncpg just like in production.
+# Each test holds a single connection of its own, so there is nothing to pool
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=NullPool)
+instrument_engine(async_engine)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def database():
+    """Creates the test database if needed and a fresh schema in it, once for the whole run."""
+    server = create_engine(f"{SERVER_URL}/postgres", isolation_level="AUTOCOMMIT")
+    with server.connect() as conn:
+        exists = conn.execute(text("SELECT 1 FROM pg_database WHERE datname = :name"), {"name": TEST_DATABASE_NAME}).scalar()
+        if not exists:
+            conn.execute(text(f'CREATE DATABASE "{TEST_DATABASE_NAME}"'))
+    server.dispose()
+    # keep the tables after the run so that we can debug any error
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    yield
+    engine.dispose()
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 
+@pytest.fixture(scope="session", autouse=True)
+def cheap_password_hashing():
+    """
+    Every test signs up two users: at the production cost of ~300 ms a hash, bcrypt
+    took most of the suite's time. Hashes made here verify the same way, just cheaper.
+    A fixture rather than at import, since benchmarks.seed imports this module.
+    """
+    production = utils.pwd_context.to_dict()
+    utils.pwd_context.update(bcrypt__rounds=4)
+    yield
+    utils.pwd_context.load(production)
 
-SQLALCHEMY_DATABASE_URL = f"postgresql://{settings.DATABASE_USERNAME}:{settings.DATABASE_PASSWORD}@{settings.DATABASE_HOSTNAME}:{settings.DATABASE_PORT}/{settings.DATABASE_NAME}_test"
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def joined_session(connection: AsyncConnection) -> AsyncSession:
+    """
+    A session on the test's connection. Its commits only release a SAVEPOINT, a new
+    one is started right away, so whatever it writes stays inside the transaction
+    that is rolled back after the test, and a rollback only undoes its own work.
+    """
+    session = AsyncSession(bind=connection, autoflush=False, expire_on_commit=False)
+
+    @event.listens_for(session.sync_session, "after_transaction_end")
+    def restart_savepoint(sync_session, transaction):
+        if not connection.closed and not connection.in_nested_transaction():
+            connection.sync_connection.begin_nested()
+
+    return session
+
+
+class PortalSession:
+    """
+    The fixtures' synchronous view of a session on the test's connection: every call
+    that talks to the database runs on the app's event loop through the TestClient portal.
+    """
+
+    def __init__(self, portal, session: AsyncSession):
+        self.portal = portal
+        self.session = session
+
+    def add(self, instance):
+        self.session.add(instance)
+
+    def add_all(self, instances):
+        self.session.add_all(instances)
+
+    def commit(self):
+        self.portal.call(self.session.commit)
+
+    def refresh(self, instance):
+        self.portal.call(self.session.refresh, instance)
+
+    def scalars(self, statement) -> list:
+        async def scalars():
+            return (await self.session.execute(statement)).scalars().all()
+        return self.portal.call(scalars)
+
+    def run(self, function, *args):
+        """The result of `await function(session, *args)`, e.g. session.run(reconcile_vote_counts)."""
+        return self.portal.call(function, self.session, *args)
 
 
 @pytest.fixture
-def session():
-    # keep the table so that we can debug any error
-    # you can choose alemic to create and drop the table. but here we use sqlalchemy to create and drop the table
-    Base.metadata.drop_all(bind=engine)
-    Base.metadata.create_all(bind=engine)
-    db = TestingSessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-        
+def count_queries():
+    """
+    with count_queries() as queries:
+        client.get("/posts/")
+    assert len(queries) == 1
+
+    `queries` collects every SQL statement the app sends while the block runs.
+    """
+    @contextmanager
+    def counter():
+        statements = []
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            # leave out the SAVEPOINTs that keep each test inside its own transaction
+            if not statement.startswith(("SAVEPOINT", "RELEASE SAVEPOINT", "ROLLBACK TO SAVEPOINT")):
+                statements.append(statement)
+        event.listen(async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    return counter
+
+
+@pytest.fixture
+def test_client():
+    # entered, so that every request runs on the same event loop (the portal's) as the connection below
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def connection(test_client):
+    """The test's connection, inside a transaction that is rolled back afterwards."""
+    portal = test_client.portal
+    connection = portal.call(async_engine.connect)
+    portal.call(connection.begin)
+    portal.call(connection.begin_nested)
+    yield connection
+    portal.call(connection.rollback)
+    portal.call(connection.close)
+
+
+@pytest.fixture
+def session(test_client, connection):
+    db = PortalSession(test_client.portal, joined_session(connection))
+    yield db
+    test_client.portal.call(db.session.close)
 
 
 ## When you use a fixture with a yield, the code before the yield is executed before the test (if you have any setup there), 
 ## and the code after the yield runs after the test completes.
 @pytest.fixture
-def client(session):
-    def override_get_db():
+def client(test_client, connection):
+    async def override_get_db():
+        db = joined_session(connection)
         try:
-            yield session
+            yield db
         finally:
-            session.close()
+            await db.close()
     app.dependency_overrides[get_db] = override_get_db
-    yield TestClient(app)
+    # the rows of a test are rolled back, cached copies of them must go too
+    principal_cache.clear()
+    token_cache.clear()
+    response_cache.clear()
+    ratelimit.backend.clear()
+    feed_index.reset()
+    yield test_client
+    app.dependency_overrides.pop(get_db, None)
 
-    
 
 @pytest.fixture
 def test_user(client):
@@ -98,5 +238,5 @@ def test_posts(test_user, different_test_user, session):
     session.add_all(posts)
     session.commit()
     
-    posts = session.query(models.Posts).all()
+    posts = session.scalars(select(models.Posts).order_by(models.Posts.id))
     return posts
\ No newline at end of file
@@ -0,0 +1,189 @@
+import asyncio
+import pytest
+from prometheus_client import REGISTRY
+from sqlalchemy import text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+
+from app import database, replicas
+from app.config import settings
+from app.logs import JsonFormatter
+from app.routers import post as post_router
+from tests.conftest import ASYNC_SQLALCHEMY_DATABASE_URL, joined_session
+
+
+def sample(name, pool):
+    return REGISTRY.get_sample_value(name, {"pool": pool}) or 0
+
+
+@pytest.fixture
+def small_pool(monkeypatch):
+    monkeypatch.setattr(settings, "DATABASE_POOL_SIZE", 1)
+    monkeypatch.setattr(settings, "DATABASE_MAX_OVERFLOW", 1)
+    monkeypatch.setattr(settings, "DATABASE_POOL_TIMEOUT", 0.2)
+
+
+def test_pool_settings(small_pool):
+    engine = database.create_db_engine(ASYNC_SQLALCHEMY_DATABASE_URL, name="settings")
+    pool = engine.sync_engine.pool
+    assert isinstance(pool, database.InstrumentedPool)
+    assert pool.size() == 1
+    assert pool._max_overflow == 1
+    assert pool._timeout == 0.2
+    assert pool._pre_ping is settings.DATABASE_POOL_PRE_PING
+
+
+def test_pool_metrics(small_pool):
+    engine = database.create_db_engine(ASYNC_SQLALCHEMY_DATABASE_URL, name="metrics")
+    waits = sample("db_pool_checkout_seconds_count", "metrics")
+
+    async def exhaust():
+        async with engine.connect() as first, engine.connect() as second:
+            await first.execute(text("SELECT 1"))
+            await second.execute(text("SELECT 1"))
+            assert sample("db_pool_checked_out", "metrics") == 2
+            assert sample("db_pool_saturation", "metrics") == 1
+            with pytest.raises(PoolTimeoutError):
+                async with engine.connect() as third:
+                    await third.execute(text("SELECT 1"))
+        await engine.dispose()
+
+    asyncio.run(exhaust())
+    assert sample("db_pool_checked_out", "metrics") == 0
+    assert sample("db_pool_timeouts_total", "metrics") == 1
+    assert sample("db_pool_checkout_seconds_count", "metrics") == waits + 3
+
+
+def test_pgbouncer_mode(monkeypatch):
+    monkeypatch.setattr(settings, "DATABASE_PGBOUNCER", True)
+    engine = database.create_db_engine(ASYNC_SQLALCHEMY_DATABASE_URL, name="pgbouncer")
+
+    async def select_one():
+        async with engine.connect() as conn:
+            return (await conn.execute(text("SELECT 1"))).scalar()
+
+    assert isinstance(engine.sync_engine.pool, NullPool)
+    assert asyncio.run(select_one()) == 1
+
+
+def reads(database_name):
+    return REGISTRY.get_sample_value("db_reads_total", {"database": database_name}) or 0
+
+
+@pytest.fixture
+def two_replicas(monkeypatch, connection):
+    # two stand-in replicas, both the test database, seen through the test's transaction
+    stand_ins = [replicas.Replica(f"replica{i}", create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=NullPool))
+                 for i in range(2)]
+    for replica in stand_ins:
+        replica.SessionLocal = lambda: joined_session(connection)
+    monkeypatch.setattr(replicas.read_router, "replicas", stand_ins)
+    monkeypatch.setattr(replicas.read_router, "strategy", "round_robin")
+    replicas.read_router._recent_writers.clear()
+    return stand_ins
+
+
+def test_replica_round_robin(two_replicas):
+    chosen = [replicas.read_router.choose(1).name for _ in range(4)]
+    assert sorted(chosen) == ["replica0", "replica0", "replica1", "replica1"]
+    assert chosen[0] != chosen[1]
+
+
+def test_replica_least_connections(two_replicas, monkeypatch):
+    monkeypatch.setattr(replicas.read_router, "strategy", "least_connections")
+    two_replicas[0].in_use = 3
+    assert replicas.read_router.choose(1) is two_replicas[1]
+    two_replicas[1].in_use = 4
+    assert replicas.read_router.choose(1) is two_replicas[0]
+
+
+def test_replica_read_your_writes(two_replicas):
+    replicas.read_router.mark_write(1)
+    assert replicas.read_router.choose(1) is None
+    assert replicas.read_router.choose(2) is not None
+
+
+def test_no_replicas_reads_primary():
+    assert replicas.ReplicaRouter([]).choose(1) is None
+    with pytest.raises(ValueError):
+        replicas.ReplicaRouter([], strategy="random")
+
+
+def test_get_endpoints_read_from_replicas(authorized_client, test_posts, test_user, two_replicas):
+    before = {name: reads(name) for name in ("primary", "replica0", "replica1")}
+    assert authorized_client.get("/posts/").status_code == 200
+    assert authorized_client.get(f"/posts/{test_posts[0].id}").status_code == 200
+    assert authorized_client.get(f"/users/{test_user['id']}").status_code == 200
+
+    assert reads("primary") == before["primary"]
+    assert reads("replica0") + reads("replica1") == before["replica0"] + before["replica1"] + 3
+    assert all(replica.in_use == 0 for replica in two_replicas)
+
+
+def test_export_holds_its_replica_while_streaming(authorized_client, test_posts, two_replicas, monkeypatch):
+    streaming = []
+
+    def export_ndjson(rows):
+        streaming.append(sum(replica.in_use for replica in two_replicas))
+        return b""
+    monkeypatch.setattr(post_router, "export_ndjson", export_ndjson)
+    assert authorized_client.get("/posts/export").status_code == 200
+    # counted for least_connections while the rows are sent, released after
+    assert streaming == [1]
+    assert all(replica.in_use == 0 for replica in two_replicas)
+
+
+def test_reads_stick_to_primary_after_write(authorized_client, test_posts, two_replicas):
+    authorized_client.post("/votes/", json={"post_id": test_posts[0].id, "dir": 1})
+    primary_reads = reads("primary")
+    res = authorized_client.get(f"/posts/{test_posts[0].id}")
+    assert res.json()["votes"] == 1
+    assert reads("primary") == primary_reads + 1
+
+
+def test_server_timing_header(authorized_client, test_posts):
+    res = authorized_client.get(f"/posts/{test_posts[0].id}")
+    timing = dict(part.strip().split(";", 1) for part in res.headers["Server-Timing"].split(","))
+    # the query, plus the SAVEPOINTs of the test's transaction
+    assert not timing["db"].endswith('desc="0 queries"')
+    # served from the response cache
+    res = authorized_client.get(f"/posts/{test_posts[0].id}")
+    assert 'desc="0 queries"' in res.headers["Server-Timing"]
+
+
+def test_request_metrics(authorized_client, test_posts):
+    labels = {"method": "GET", "route": "/posts/{id}", "status": "200"}
+    before = REGISTRY.get_sample_value("http_request_seconds_count", labels) or 0
+    queries = REGISTRY.get_sample_value("http_request_db_queries_sum", {"method": "GET", "route": "/posts/{id}"}) or 0
+    authorized_client.get(f"/posts/{test_posts[0].id}")
+    assert REGISTRY.get_sample_value("http_request_seconds_count", labels) == before + 1
+    assert REGISTRY.get_sample_value("http_request_db_queries_sum", {"method": "GET", "route": "/posts/{id}"}) > queries
+
+
+def test_sql_compile_cache_metrics(authorized_client, test_posts):
+    labels = {"database": "primary", "result": "hit"}
+    authorized_client.get(f"/posts/{test_posts[0].id}")
+    hits = REGISTRY.get_sample_value("sql_compile_cache_total", labels) or 0
+    misses = REGISTRY.get_sample_value("sql_compile_cache_total", {**labels, "result": "miss"}) or 0
+    # another id: a miss of the response cache, but the same compiled statement
+    authorized_client.get(f"/posts/{test_posts[1].id}")
+
+    assert REGISTRY.get_sample_value("sql_compile_cache_total", labels) > hits
+    assert (REGISTRY.get_sample_value("sql_compile_cache_total", {**labels, "result": "miss"}) or 0) == misses
+
+
+def test_slow_query_log_redacts_parameters(client, test_user, monkeypatch, caplog):
+    monkeypatch.setattr(settings, "SLOW_QUERY_MS", 0)
+    with caplog.at_level("WARNING", logger="app.instrumentation"):
+        client.post("/login", data={"username": test_user["email"], "password": test_user["password"]})
+    [record] = [record for record in caplog.records if record.getMessage() == "slow query" and "FROM users" in record.statement]
+    assert "FROM users" in record.statement
+    assert record.parameters == ["str"]
+    assert test_user["email"] not in JsonFormatter().format(record)
+
+
+def test_metrics_endpoint_multiprocess(client, tmp_path, monkeypatch):
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    res = client.get("/metrics")
+    assert res.status_code == 200
@@ -1,5 +1,15 @@
+import asyncio
+import csv
+import io
+import json
 import pytest
-from app import schemas
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from app import models, oauth2, schemas
+from app.cache import POSTS_LIST_TAG, InMemoryKeyValueStore, LocalCacheBackend, SharedCacheBackend, post_tag, response_cache
+from app.config import settings
+from app.feeds import FeedIndex, RankedFeed, feed_index, top_score
+from app.routers.post import posts_page_statement, select_posts_page
 
 #---------------------Get Post---------------------
 def test_get_all_posts(authorized_client, test_posts):
@@ -9,6 +19,27 @@ def test_get_all_posts(authorized_client, test_posts):
     assert res.status_code == 200
 
 
+def test_get_posts_row_serialization(authorized_client, test_posts, monkeypatch):
+    orm = authorized_client.get("/posts/?limit=3")
+    monkeypatch.setattr(settings, "POSTS_ROW_SERIALIZATION", True)
+    response_cache.clear()
+    rows = authorized_client.get("/posts/?limit=3")
+
+    assert rows.status_code == 200
+    assert rows.content == orm.content
+    assert rows.headers["X-Next-Cursor"] == orm.headers["X-Next-Cursor"]
+
+
+def test_get_posts_row_serialization_search(authorized_client, test_posts, monkeypatch):
+    orm = authorized_client.get("/posts/", params={"search": "content", "limit": 2})
+    monkeypatch.setattr(settings, "POSTS_ROW_SERIALIZATION", True)
+    response_cache.clear()
+    rows = authorized_client.get("/posts/", params={"search": "content", "limit": 2})
+
+    assert rows.content == orm.content
+    assert rows.headers["X-Next-Cursor"] == orm.headers["X-Next-Cursor"]
+
+
 def test_get_one_post(authorized_client, test_posts):
     res = authorized_client.get(f"/posts/{test_posts[0].id}")
     # print(res.json())
@@ -20,6 +51,348 @@ def test_get_one_post(authorized_client, test_posts):
     assert res.status_code == 200
 
 
+@pytest.mark.parametrize("limit", [1, 4, 10])
+def test_get_posts_query_count(authorized_client, test_posts, session, count_queries, limit):
+    session.add_all([models.Posts(title=f"Extra {i}", content="content", owner_id=post.owner_id)
+                     for i, post in enumerate(test_posts * 3)])
+    session.commit()
+    with count_queries() as queries:
+        res = authorized_client.get(f"/posts/?limit={limit}")
+    assert len(res.json()) == limit
+    assert all(post["Posts"]["owner"]["email"] for post in res.json())
+    # posts, vote counts, has_voted and owners all come from one statement, whatever the page size
+    assert len(queries) == 1
+    assert "EXISTS" in queries[0]
+    assert "password" not in queries[0]
+
+
+def test_get_one_post_query_count(authorized_client, test_posts, count_queries):
+    with count_queries() as queries:
+        authorized_client.get(f"/posts/{test_posts[0].id}")
+    assert len(queries) == 1
+
+
+def test_get_posts_cursor_pagination(authorized_client, test_posts):
+    first = authorized_client.get("/posts/?limit=2")
+    cursor = first.headers["X-Next-Cursor"]
+    second = authorized_client.get(f"/posts/?limit=2&cursor={cursor}")
+    last = authorized_client.get(f"/posts/?limit=2&cursor={second.headers['X-Next-Cursor']}")
+
+    first_ids = [post["Posts"]["id"] for post in first.json()]
+    second_ids = [post["Posts"]["id"] for post in second.json()]
+    assert first.status_code == second.status_code == 200
+    assert sorted(first_ids + second_ids) == sorted(post.id for post in test_posts)
+    assert first_ids == sorted(first_ids, reverse=True)
+    assert last.json() == []
+    assert "X-Next-Cursor" not in last.headers
+
+
+def test_get_posts_cursor_matches_skip(authorized_client, test_posts):
+    first = authorized_client.get("/posts/?limit=1")
+    by_cursor = authorized_client.get(f"/posts/?limit=3&cursor={first.headers['X-Next-Cursor']}")
+    by_skip = authorized_client.get("/posts/?limit=3&skip=1")
+    assert by_cursor.json() == by_skip.json()
+
+
+def test_page_statements_are_built_once(authorized_client, test_posts):
+    first = authorized_client.get("/posts/", params={"limit": 2})
+    built = posts_page_statement.cache_info().currsize
+    authorized_client.get("/posts/", params={"limit": 3, "cursor": first.headers["X-Next-Cursor"]})
+    authorized_client.get("/posts/", params={"limit": 2, "cursor": first.headers["X-Next-Cursor"]})
+    authorized_client.get("/posts/", params={"limit": 4})
+    # one more shape (with a cursor), whatever the values
+    assert posts_page_statement.cache_info().currsize <= built + 1
+    statement, parameters = select_posts_page(5, 1, search="fast api")
+    assert statement is select_posts_page(7, 2, search="other words")[0]
+    assert parameters == {"limit": 5, "viewer_id": 1, "tsquery": "fast:* & api:*"}
+
+
+def test_get_posts_invalid_cursor(authorized_client, test_posts):
+    res = authorized_client.get("/posts/?cursor=not-a-cursor")
+    assert res.status_code == 400
+
+
+@pytest.mark.parametrize("search, titles", [
+    ("", ["Post 1", "Post 2", "Post 3", "Post 3"]),
+    ("   ", ["Post 1", "Post 2", "Post 3", "Post 3"]),
+    ("post", ["Post 1", "Post 2", "Post 3", "Post 3"]),
+    ("post 2", ["Post 2"]),
+    ("content 3", ["Post 3", "Post 3"]),
+    ("cont", ["Post 1", "Post 2", "Post 3", "Post 3"]),
+    ("missing", []),
+])
+def test_search_posts(authorized_client, test_posts, search, titles):
+    res = authorized_client.get("/posts/", params={"search": search})
+    assert res.status_code == 200
+    assert sorted(post["Posts"]["title"] for post in res.json()) == titles
+
+
+def test_search_ranks_title_above_content(authorized_client, session, test_posts):
+    test_posts[1].content = "a post about postgres"
+    test_posts[2].title = "postgres tuning"
+    session.commit()
+    res = authorized_client.get("/posts/", params={"search": "postgres"})
+    assert [post["Posts"]["id"] for post in res.json()] == [test_posts[2].id, test_posts[1].id]
+
+
+def test_search_cursor_pagination(authorized_client, test_posts):
+    first = authorized_client.get("/posts/", params={"search": "post", "limit": 3})
+    second = authorized_client.get("/posts/", params={"search": "post", "limit": 3, "cursor": first.headers["X-Next-Cursor"]})
+    ids = [post["Posts"]["id"] for post in first.json() + second.json()]
+    assert sorted(ids) == sorted(post.id for post in test_posts)
+
+
+def test_has_voted_is_per_viewer(authorized_client, test_posts, different_test_user):
+    voted = test_posts[1].id
+    authorized_client.post("/votes/", json={"post_id": voted, "dir": 1})
+    other = {"Authorization": f"Bearer {oauth2.create_access_token({'user_id': different_test_user['id']})}"}
+
+    for headers, expected in (({}, {voted}), (other, set())):
+        for url in ("/posts/", "/posts/top", "/posts/export"):
+            res = authorized_client.get(url, headers=headers)
+            posts = res.json() if url != "/posts/export" else [json.loads(line) for line in res.text.splitlines()]
+            assert {post["Posts"]["id"] for post in posts if post["has_voted"]} == expected
+        assert authorized_client.get(f"/posts/{voted}", headers=headers).json()["has_voted"] == bool(expected)
+
+
+def test_cached_pages_are_per_viewer(authorized_client, test_posts, different_test_user):
+    voted = test_posts[0].id
+    authorized_client.post("/votes/", json={"post_id": voted, "dir": 1})
+    mine = authorized_client.get(f"/posts/{voted}")
+    other = {"Authorization": f"Bearer {oauth2.create_access_token({'user_id': different_test_user['id']})}"}
+    theirs = authorized_client.get(f"/posts/{voted}", headers=other)
+    assert theirs.headers["X-Cache"] == "MISS"
+    assert (mine.json()["has_voted"], theirs.json()["has_voted"]) == (True, False)
+    assert mine.headers["ETag"] != theirs.headers["ETag"]
+    assert theirs.headers["Vary"] == "Authorization"
+    assert authorized_client.get(f"/posts/{voted}", headers={"If-None-Match": mine.headers["ETag"]},
+                                 ).status_code == 304
+    assert authorized_client.get(f"/posts/{voted}", headers={**other, "If-None-Match": mine.headers["ETag"]},
+                                 ).status_code == 200
+
+    # taking the vote back flips the viewer's cached page
+    assert authorized_client.get("/posts/").json()[-1]["has_voted"] is True
+    authorized_client.post("/votes/", json={"post_id": voted, "dir": 0})
+    assert authorized_client.get("/posts/").json()[-1]["has_voted"] is False
+
+
+def test_get_posts_served_from_cache(authorized_client, test_posts, count_queries):
+    first = authorized_client.get("/posts/")
+    with count_queries() as statements:
+        second = authorized_client.get("/posts/")
+    assert first.headers["X-Cache"] == "MISS"
+    assert second.headers["X-Cache"] == "HIT"
+    assert int(second.headers["Age"]) >= 0
+    assert second.content == first.content
+    assert statements == []
+
+
+def test_vote_invalidates_cached_post_and_pages(authorized_client, test_posts):
+    voted, other = test_posts[0].id, test_posts[3].id
+    for url in (f"/posts/{voted}", f"/posts/{other}", "/posts/"):
+        authorized_client.get(url)
+    authorized_client.post("/votes/", json={"post_id": voted, "dir": 1})
+
+    post = authorized_client.get(f"/posts/{voted}")
+    assert post.headers["X-Cache"] == "MISS"
+    assert post.json()["votes"] == 1
+    page = authorized_client.get("/posts/")
+    assert page.headers["X-Cache"] == "MISS"
+    assert {item["Posts"]["id"]: item["votes"] for item in page.json()}[voted] == 1
+    assert authorized_client.get(f"/posts/{other}").headers["X-Cache"] == "HIT"
+
+
+def test_create_post_invalidates_cached_pages(authorized_client, test_posts):
+    authorized_client.get("/posts/")
+    authorized_client.post("/posts/", json={"title": "Post 5", "content": "Content 5"})
+    res = authorized_client.get("/posts/")
+    assert res.headers["X-Cache"] == "MISS"
+    assert len(res.json()) == len(test_posts) + 1
+
+
+def test_update_post_invalidates_cached_searches(authorized_client, test_posts):
+    assert authorized_client.get("/posts/", params={"search": "postgres"}).json() == []
+    authorized_client.put(f"/posts/{test_posts[1].id}", json={"title": "postgres", "content": "tuning"})
+    res = authorized_client.get("/posts/", params={"search": "postgres"})
+    assert [post["Posts"]["id"] for post in res.json()] == [test_posts[1].id]
+
+
+def test_shared_cache_invalidation_reaches_every_worker():
+    store = InMemoryKeyValueStore()
+    worker_a, worker_b = SharedCacheBackend(store), SharedCacheBackend(store)
+    worker_a.set("posts:item:1", b"{}", tags=[post_tag(1)])
+    worker_a.set("posts:item:2", b"{}", tags=[post_tag(2)])
+    assert worker_b.get("posts:item:1").value == b"{}"
+
+    worker_b.invalidate_tags(post_tag(1))
+    assert worker_a.get("posts:item:1") is None
+    assert worker_a.get("posts:item:2").value == b"{}"
+
+
+@pytest.mark.parametrize("make_backend", [lambda: LocalCacheBackend(), lambda: SharedCacheBackend(InMemoryKeyValueStore())])
+def test_response_read_during_a_write_is_not_cached(make_backend):
+    backend = make_backend()
+    version = backend.version()
+    # a write commits and invalidates while the read is still running
+    backend.invalidate_tags(post_tag(1))
+    backend.set("posts:item:1", b"stale", tags=[post_tag(1)], version=version)
+    assert backend.get("posts:item:1") is None
+
+    backend.set("posts:item:1", b"fresh", tags=[post_tag(1)], version=backend.version())
+    assert backend.get("posts:item:1").value == b"fresh"
+
+
+def test_local_cache_forgets_the_tags_of_dropped_entries():
+    backend = LocalCacheBackend(maxsize=10)
+    for i in range(1000):
+        backend.set(f"posts:list:{i}", b"[]", tags=[POSTS_LIST_TAG])
+    assert len(backend._keys_by_tag[POSTS_LIST_TAG]) == 10
+
+    backend.set("posts:list:999", b"[]", tags=[post_tag(1)])
+    assert "posts:list:999" not in backend._keys_by_tag[POSTS_LIST_TAG]
+
+    backend.set("posts:item:1", b"{}", tags=[post_tag(1)], ttl=0)
+    assert backend.get("posts:item:1") is None
+    assert backend._keys_by_tag[post_tag(1)] == {"posts:list:999"}
+
+
+def test_get_post_not_modified(authorized_client, test_posts, count_queries):
+    res = authorized_client.get(f"/posts/{test_posts[0].id}")
+    etag, last_modified = res.headers["ETag"], res.headers["Last-Modified"]
+
+    with count_queries() as statements:
+        cached = authorized_client.get(f"/posts/{test_posts[0].id}", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+    assert statements == []
+
+    response_cache.clear()
+    with count_queries() as statements:
+        revalidated = authorized_client.get(f"/posts/{test_posts[0].id}", headers={"If-Modified-Since": last_modified})
+    assert revalidated.status_code == 304
+    assert revalidated.headers["ETag"] == etag
+    # the version-only query, not the post joined to its owner
+    assert len(statements) == 1 and "JOIN" not in statements[0]
+
+
+def test_vote_changes_post_etag(authorized_client, test_posts):
+    etag = authorized_client.get(f"/posts/{test_posts[0].id}").headers["ETag"]
+    authorized_client.post("/votes/", json={"post_id": test_posts[0].id, "dir": 1})
+    res = authorized_client.get(f"/posts/{test_posts[0].id}", headers={"If-None-Match": etag})
+    assert res.status_code == 200
+    assert res.headers["ETag"] != etag
+    assert res.json()["votes"] == 1
+
+
+def test_get_posts_not_modified(authorized_client, test_posts):
+    etag = authorized_client.get("/posts/").headers["ETag"]
+    assert authorized_client.get("/posts/", headers={"If-None-Match": f'W/{etag}, "other"'}).status_code == 304
+    authorized_client.put(f"/posts/{test_posts[0].id}", json={"title": "Changed", "content": "Content 1"})
+    assert authorized_client.get("/posts/", headers={"If-None-Match": etag}).status_code == 200
+
+
+def feed_ids(response) -> list[int]:
+    return [post["Posts"]["id"] for post in response.json()]
+
+
+def test_top_posts_follow_votes(authorized_client, test_posts):
+    ids = [post.id for post in test_posts]
+    res = authorized_client.get("/posts/top")
+    assert res.status_code == 200
+    # no votes yet: newest first
+    assert feed_ids(res) == ids[::-1]
+    assert res.headers["X-Feed-Age"] == "0"
+
+    authorized_client.post("/votes/", json={"post_id": ids[1], "dir": 1})
+    res = authorized_client.get("/posts/top")
+    assert feed_ids(res) == [ids[1], ids[3], ids[2], ids[0]]
+    assert res.json()[0]["votes"] == 1
+
+
+def test_trending_posts(authorized_client, test_posts, different_test_user):
+    ids = [post.id for post in test_posts]
+    authorized_client.get("/posts/trending")
+    authorized_client.post("/votes/bulk", json=[{"post_id": ids[0], "dir": 1}, {"post_id": ids[2], "dir": 1}])
+    other = {"Authorization": f"Bearer {oauth2.create_access_token({'user_id': different_test_user['id']})}"}
+    authorized_client.post("/votes/", json={"post_id": ids[0], "dir": 1}, headers=other)
+
+    # same age: two votes beat one, and one vote counts as none (log10(1) == 0)
+    assert feed_ids(authorized_client.get("/posts/trending")) == [ids[0], ids[3], ids[2], ids[1]]
+
+
+def test_feed_cursor_pagination(authorized_client, test_posts):
+    everything = feed_ids(authorized_client.get("/posts/top"))
+    first = authorized_client.get("/posts/top", params={"limit": 3})
+    second = authorized_client.get("/posts/top", params={"limit": 3, "cursor": first.headers["X-Next-Cursor"]})
+
+    assert feed_ids(first) + feed_ids(second) == everything
+    assert "X-Next-Cursor" not in second.headers
+    assert authorized_client.get("/posts/top", params={"cursor": "nope"}).status_code == 400
+
+
+@pytest.mark.parametrize("url", ["/posts/", "/posts/top", "/posts/trending"])
+@pytest.mark.parametrize("limit", [-1, 0, 101])
+def test_page_limit_is_bounded(authorized_client, test_posts, url, limit):
+    assert authorized_client.get(url, params={"limit": limit}).status_code == 422
+
+
+def test_feeds_follow_created_and_deleted_posts(authorized_client, test_posts):
+    authorized_client.get("/posts/top")
+    created = authorized_client.post("/posts/", json={"title": "Post 5", "content": "Content 5"}).json()["id"]
+    authorized_client.delete(f"/posts/{test_posts[0].id}")
+
+    ids = feed_ids(authorized_client.get("/posts/trending"))
+    assert ids[0] == created
+    assert test_posts[0].id not in ids
+
+
+def test_stale_feed_is_rebuilt_in_the_background(authorized_client, test_posts, session, monkeypatch):
+    authorized_client.get("/posts/top")
+    # as if created on another worker: in the table, not in this worker's index
+    created = authorized_client.post("/posts/", json={"title": "Post 5", "content": "Content 5"}).json()["id"]
+    feed_index.remove(created)
+    monkeypatch.setattr(settings, "FEED_REFRESH_SECONDS", 0)
+    # the real task opens a session of its own, the test has only the one connection
+    rebuilds = []
+    async def rebuild_in_background():
+        rebuilds.append(feed_index.age)
+    monkeypatch.setattr(feed_index, "_rebuild_in_background", rebuild_in_background)
+
+    stale = authorized_client.get("/posts/top")
+    assert len(stale.json()) == len(test_posts)
+    assert len(rebuilds) == 1
+
+    session.run(feed_index.rebuild)
+    assert len(authorized_client.get("/posts/top").json()) == len(test_posts) + 1
+
+
+def test_feed_rebuild_replays_posts_created_and_deleted_during_the_scan():
+    index = FeedIndex()
+    now = datetime.now(timezone.utc)
+
+    class ScanningSession:
+        async def execute(self, statement):
+            # committed after the scan's snapshot: post 3 created, post 1 deleted
+            index.add(3, now)
+            index.remove(1)
+            return [SimpleNamespace(id=id, created_at=now, vote_count=0) for id in (1, 2)]
+
+    asyncio.run(index.rebuild(ScanningSession()))
+    assert [id for _, id in index.feeds["top"].page(10)] == [3, 2]
+
+
+def test_ranked_feed_updates_in_place():
+    feed = RankedFeed(top_score)
+    feed.load({1: (0.0, 5), 2: (0.0, 3), 3: (0.0, 3)})
+    assert feed.page(10) == [(5.0, 1), (3.0, 3), (3.0, 2)]
+
+    feed.update(2, 0.0, 6)
+    feed.remove(1)
+    assert feed.page(10) == [(6.0, 2), (3.0, 3)]
+    assert feed.page(10, after=(6.0, 2)) == [(3.0, 3)]
+    assert len(feed) == 2
+
+
 def test_unauthorized_get_all_posts(client, test_posts):
     res = client.get("/posts/")
     assert res.status_code == 401
@@ -31,7 +404,7 @@ def test_unauthorized_get_one_posts(client, test_posts):
 
 
 def test_get_one_posts_non_existent(authorized_client, test_posts):
-    res = authorized_client.get("/posts/100")
+    res = authorized_client.get("/posts/1000000")
     assert res.status_code == 404
 
 
@@ -79,7 +452,7 @@ def test_delete_post(authorized_client, test_posts):
 
 
 def test_delete_post_non_exist(authorized_client):
-    res = authorized_client.delete("/posts/100")
+    res = authorized_client.delete("/posts/1000000")
     assert res.status_code == 404
 
 
@@ -93,6 +466,16 @@ def test_delete_other_user_post(authorized_client, test_posts):
     assert res.status_code == 403
 
 
+@pytest.mark.parametrize("post_index, status_code, statements", [(0, 204, 1), (3, 403, 2)])
+def test_delete_post_round_trips(authorized_client, test_posts, count_queries, post_index, status_code, statements):
+    with count_queries() as queries:
+        res = authorized_client.delete(f"/posts/{test_posts[post_index].id}")
+    assert res.status_code == status_code
+    # the conditional DELETE, and a probe only when it matched nothing
+    assert len(queries) == statements
+    assert authorized_client.get(f"/posts/{test_posts[3].id}").status_code == 200
+
+
 #---------------------Update Post---------------------
 def test_update_post(authorized_client, test_posts):
     post_data = {"title": "Post 1 Updated", "content": "Content 1 Updated"}
@@ -106,7 +489,7 @@ def test_update_post(authorized_client, test_posts):
 
 def test_update_post_non_exist(authorized_client):
     post_data = {"title": "Post 1 Updated", "content": "Content 1 Updated"}
-    res = authorized_client.put("/posts/100", json=post_data)
+    res = authorized_client.put("/posts/1000000", json=post_data)
     assert res.status_code == 404
 
 
@@ -119,4 +502,102 @@ def test_unauthorized_update_post(client, test_posts):
 def test_update_other_user_post(authorized_client, test_posts):
     post_data = {"title": "Post 3 Updated", "content": "Content 3 Updated"}
     res = authorized_client.put(f"/posts/{test_posts[3].id}", json=post_data)
-    assert res.status_code == 403
\ No newline at end of file
+    assert res.status_code == 403
+
+
+@pytest.mark.parametrize("id, status_code, statements", [("own", 200, 1), ("other", 403, 2), (1_000_000, 404, 2)])
+def test_update_post_round_trips(authorized_client, test_posts, test_user, count_queries, id, status_code, statements):
+    id = {"own": test_posts[0].id, "other": test_posts[3].id}.get(id, id)
+    with count_queries() as queries:
+        res = authorized_client.put(f"/posts/{id}", json={"title": "Updated", "content": "Updated"})
+    assert res.status_code == status_code
+    assert len(queries) == statements
+    if status_code == 200:
+        owner = res.json()["owner"]
+        assert (owner["id"], owner["email"]) == (test_user["id"], test_user["email"])
+        assert authorized_client.get(f"/posts/{id}").json()["Posts"]["title"] == "Updated"
+    assert authorized_client.get(f"/posts/{test_posts[3].id}").json()["Posts"]["title"] == "Post 3"
+
+#---------------------Bulk---------------------
+def test_bulk_create_posts(authorized_client, test_user, count_queries):
+    posts = [{"title": f"Bulk {i}", "content": f"Content {i}"} for i in range(5)]
+    with count_queries() as statements:
+        res = authorized_client.post("/posts/bulk", json=posts)
+    assert res.status_code == 200
+    assert [item["status"] for item in res.json()] == ["created"] * 5
+    assert len([statement for statement in statements if statement.startswith("INSERT")]) == 1
+
+    for item, post in zip(res.json(), posts):
+        created = authorized_client.get(f"/posts/{item['id']}").json()["Posts"]
+        assert created["title"] == post["title"]
+        assert created["owner_id"] == test_user["id"]
+
+
+def test_bulk_update_posts(authorized_client, test_posts):
+    items = [
+        {"id": test_posts[0].id, "title": "Updated 1", "content": "Content 1"},
+        {"id": test_posts[3].id, "title": "Not mine", "content": "Content 3"},
+        {"id": 1_000_000, "title": "Missing", "content": "Content"},
+    ]
+    res = authorized_client.put("/posts/bulk", json=items)
+    assert res.status_code == 200
+    assert [item["status"] for item in res.json()] == ["updated", "forbidden", "not_found"]
+    assert authorized_client.get(f"/posts/{test_posts[0].id}").json()["Posts"]["title"] == "Updated 1"
+    assert authorized_client.get(f"/posts/{test_posts[3].id}").json()["Posts"]["title"] == "Post 3"
+
+
+def test_bulk_delete_posts(authorized_client, test_posts):
+    ids = [test_posts[0].id, test_posts[1].id, test_posts[3].id, 1_000_000]
+    res = authorized_client.post("/posts/bulk/delete", json=ids)
+    assert [item["status"] for item in res.json()] == ["deleted", "deleted", "forbidden", "not_found"]
+    assert len(authorized_client.get("/posts/").json()) == len(test_posts) - 2
+
+
+def test_bulk_too_many_items(authorized_client, monkeypatch):
+    monkeypatch.setattr(settings, "BULK_MAX_ITEMS", 2)
+    res = authorized_client.post("/posts/bulk/delete", json=[1, 2, 3])
+    assert res.status_code == 413
+
+
+#---------------------Export---------------------
+def test_export_posts_ndjson(authorized_client, test_posts, monkeypatch):
+    monkeypatch.setattr(settings, "EXPORT_CHUNK_SIZE", 3)
+    res = authorized_client.get("/posts/export")
+    assert res.status_code == 200
+    assert res.headers["content-type"] == "application/x-ndjson"
+    assert res.headers["content-encoding"] == "gzip"
+    lines = [json.loads(line) for line in res.text.splitlines()]
+    assert [line["Posts"]["id"] for line in lines] == sorted(post.id for post in test_posts)
+    # same items as the listing
+    listed = {post["Posts"]["id"]: post for post in authorized_client.get("/posts/").json()}
+    assert all(line == listed[line["Posts"]["id"]] for line in lines)
+
+
+@pytest.mark.parametrize("accept_encoding, gzipped", [
+    ("gzip", True), ("deflate, GZIP;q=0.5", True), ("*", True),
+    ("gzip;q=0", False), ("*;q=0", False), ("identity", False), ("", False), ("*, gzip;q=0", False),
+])
+def test_export_gzip_follows_accept_encoding(authorized_client, test_posts, accept_encoding, gzipped):
+    res = authorized_client.get("/posts/export", headers={"Accept-Encoding": accept_encoding})
+    assert ("content-encoding" in res.headers) == gzipped
+    assert "Accept-Encoding" in res.headers["Vary"]
+    assert len(res.text.splitlines()) == len(test_posts)
+
+
+def test_export_posts_csv_filtered(authorized_client, test_posts, test_user, session):
+    test_posts[1].published = False
+    session.commit()
+    res = authorized_client.get("/posts/export", params={"format": "csv", "owner_id": test_user["id"], "published": True},
+                                headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in res.headers
+    rows = list(csv.DictReader(io.StringIO(res.text)))
+    assert [int(row["id"]) for row in rows] == [test_posts[0].id, test_posts[2].id]
+    assert rows[0]["owner_email"] == test_user["email"]
+    assert rows[0]["votes"] == "0"
+
+
+def test_export_posts_created_range(authorized_client, test_posts):
+    created = test_posts[0].created_at.isoformat()
+    assert authorized_client.get("/posts/export", params={"created_before": created}).text == ""
+    res = authorized_client.get("/posts/export", params={"created_after": created})
+    assert len(res.text.splitlines()) == len(test_posts)
@@ -1,5 +1,9 @@
+import asyncio
+import time
 import pytest
-from app import schemas
+from app import oauth2, schemas, utils
+from app.cache import InMemoryKeyValueStore
+from app.ratelimit import Limit, LocalRateLimitBackend, SharedRateLimitBackend
 from app.config import settings
 from jose import jwt
 
@@ -34,4 +38,158 @@ def test_incorrect_login(client, test_user, email, password, status_code):
     response = client.post("/login", data={"username": email, "password": password})
 
     assert response.status_code == status_code 
-    assert response.json().get("detail") == "Invalid credentials" if status_code == 403 else "Username and password are required"
\ No newline at end of file
+    assert response.json().get("detail") == "Invalid credentials" if status_code == 403 else "Username and password are required"
+
+
+def test_create_user_hash_pool_saturated(client, monkeypatch):
+    monkeypatch.setattr(utils.hasher, "pending", utils.hasher.workers + utils.hasher.queue_size)
+    response = client.post("/users/", json={"email": "new@gmail.com", "password": "new"})
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(utils.hasher.retry_after)
+
+
+def test_login_hash_pool_saturated(client, test_user, monkeypatch):
+    monkeypatch.setattr(utils.hasher, "pending", utils.hasher.workers + utils.hasher.queue_size)
+    response = client.post("/login", data={"username": test_user["email"], "password": test_user["password"]})
+
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
+
+
+def test_password_hash_metrics(client, test_user):
+    client.post("/login", data={"username": test_user["email"], "password": test_user["password"]})
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert 'password_hash_seconds_count{operation="hash"}' in response.text
+    assert 'password_hash_seconds_count{operation="verify"}' in response.text
+    assert "password_hash_queue_depth" in response.text
+
+
+
+def test_current_user_is_cached(authorized_client, test_user, token):
+    res = authorized_client.post("/posts/", json={"title": "title", "content": "content"})
+    assert res.status_code == 201
+    # the principal now comes from the cache, there is no session to query
+    user = asyncio.run(oauth2.get_current_user(token, None))
+    assert user.id == test_user["id"]
+    assert user.email == test_user["email"]
+
+
+def test_current_user_unknown_id(client):
+    token = oauth2.create_access_token(data={"user_id": 10**9})
+    res = client.post("/posts/", json={"title": "title", "content": "content"}, headers={"Authorization": f"Bearer {token}"})
+    assert res.status_code == 401
+
+
+def test_login_embeds_user_claims(client, test_user, monkeypatch):
+    monkeypatch.setattr(settings, "EMBED_USER_CLAIMS", True)
+    response = client.post("/login", data={"username": test_user["email"], "password": test_user["password"]})
+    access_token = response.json()["access_token"]
+    payload = jwt.decode(access_token, settings.SECRET_KEY, settings.ALGORITHM)
+    assert payload["email"] == test_user["email"]
+
+    oauth2.principal_cache.clear()
+    user = asyncio.run(oauth2.get_current_user(access_token, None))
+    assert user.id == test_user["id"]
+    assert user.email == test_user["email"]
+    assert len(oauth2.principal_cache) == 0
+
+
+def test_verified_token_is_cached(client, token):
+    credentials_exception = oauth2.get_credentials_exception()
+    first = oauth2.verify_access_token(token, credentials_exception)
+    hits = oauth2.token_cache.hits
+    second = oauth2.verify_access_token(token, credentials_exception)
+
+    assert second == first
+    assert oauth2.token_cache.hits == hits + 1
+
+
+def test_expired_token_is_not_cached(client, test_user):
+    expired = jwt.encode({"user_id": test_user["id"], "exp": int(time.time()) - 10}, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
+    with pytest.raises(ValueError):
+        oauth2.verify_access_token(expired, ValueError("invalid"))
+    assert len(oauth2.token_cache) == 0
+
+
+def test_get_user_not_modified(authorized_client, test_user):
+    res = authorized_client.get(f"/users/{test_user['id']}")
+    assert res.status_code == 200
+    etag = res.headers["ETag"]
+
+    assert authorized_client.get(f"/users/{test_user['id']}", headers={"If-None-Match": etag}).status_code == 304
+    assert authorized_client.get(f"/users/{test_user['id']}", headers={"If-None-Match": '"stale"'}).status_code == 200
+    since = authorized_client.get(f"/users/{test_user['id']}", headers={"If-Modified-Since": res.headers["Last-Modified"]})
+    assert since.status_code == 304
+
+
+def test_login_rate_limited_per_ip(client, test_user, monkeypatch):
+    monkeypatch.setattr(settings, "RATE_LIMIT_LOGIN", "2/minute")
+    credentials = {"username": test_user["email"], "password": test_user["password"]}
+    first = client.post("/login", data=credentials, headers={"X-Real-IP": "10.0.0.1"})
+    second = client.post("/login", data=credentials, headers={"X-Real-IP": "10.0.0.1"})
+    refused = client.post("/login", data=credentials, headers={"X-Real-IP": "10.0.0.1"})
+
+    assert first.status_code == second.status_code == 200
+    assert first.headers["RateLimit-Limit"] == "2"
+    assert first.headers["RateLimit-Policy"] == "2;w=60"
+    assert (first.headers["RateLimit-Remaining"], second.headers["RateLimit-Remaining"]) == ("1", "0")
+    assert refused.status_code == 429
+    assert refused.headers["Retry-After"] == "30"
+    assert refused.headers["RateLimit-Remaining"] == "0"
+    # another client behind the same proxy has a bucket of its own
+    assert client.post("/login", data=credentials, headers={"X-Real-IP": "10.0.0.2"}).status_code == 200
+
+
+def test_signup_rate_limited(client, monkeypatch):
+    monkeypatch.setattr(settings, "RATE_LIMIT_SIGNUP", "1/hour")
+    assert client.post("/users/", json={"email": "new@gmail.com", "password": "new"}).status_code == 201
+    response = client.post("/users/", json={"email": "new1@gmail.com", "password": "new"})
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "3600"
+
+
+def test_rate_limit_disabled(client, monkeypatch):
+    monkeypatch.setattr(settings, "RATE_LIMIT_SIGNUP", "1/hour")
+    monkeypatch.setattr(settings, "RATE_LIMIT_ENABLED", False)
+    assert client.post("/users/", json={"email": "new@gmail.com", "password": "new"}).status_code == 201
+    response = client.post("/users/", json={"email": "new1@gmail.com", "password": "new"})
+
+    assert response.status_code == 201
+    assert "RateLimit-Limit" not in response.headers
+
+
+def test_token_bucket_refills():
+    now = [0.0]
+    backend = LocalRateLimitBackend(clock=lambda: now[0])
+    limit = Limit.parse("2/second")
+
+    assert [backend.hit("key", limit).allowed for _ in range(3)] == [True, True, False]
+    assert backend.hit("key", limit).retry_after == pytest.approx(0.5)
+    now[0] = 0.5
+    assert backend.hit("key", limit).allowed
+    assert not backend.hit("key", limit).allowed
+    # never more than the capacity, however long the bucket sat idle
+    now[0] = 100.0
+    assert backend.hit("key", limit).remaining == 1
+    assert backend.hit("other", limit).remaining == 1
+
+
+def test_shared_rate_limit_backend():
+    store = InMemoryKeyValueStore()
+    limit = Limit.parse("3/minute")
+    workers = [SharedRateLimitBackend(store), SharedRateLimitBackend(store)]
+
+    decisions = [workers[n % 2].hit("login:10.0.0.1", limit) for n in range(4)]
+
+    assert [decision.allowed for decision in decisions] == [True, True, True, False]
+    assert [decision.remaining for decision in decisions[:3]] == [2, 1, 0]
+
+
+@pytest.mark.parametrize("limit", ["10", "ten/minute", "10/fortnight", "0/minute", "-1/minute"])
+def test_invalid_rate_limit(limit):
+    with pytest.raises(ValueError):
+        Limit.parse(limit)
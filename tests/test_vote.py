@@ -1,10 +1,20 @@
+import asyncio
 import pytest
-from app import models
+from starlette.websockets import WebSocketDisconnect
+from prometheus_client import REGISTRY
+from app import models, voting
+from app.live import LiveHub, LocalPubSubBackend, hub
+from app.config import settings
+from app.oauth2 import create_access_token
+from app.maintenance import reconcile_vote_counts
+from app.routers.live import sse_events
+from app.voting import VoteBatcher, VoteRequest, VoteResult, apply_votes
 
 @pytest.fixture
 def test_vote(test_posts, session, test_user):
     vote = models.Votes(post_id=test_posts[0].id, user_id=test_user["id"])
     session.add(vote)
+    test_posts[0].vote_count += 1
     session.commit()
     return vote
 
@@ -20,7 +30,7 @@ def test_vote_twice_one_post(authorized_client, test_posts, test_vote):
 
 
 def test_vote_post_non_exist(authorized_client, test_posts):
-    response = authorized_client.post("/votes/", json={"post_id": 1000, "dir": 1})
+    response = authorized_client.post("/votes/", json={"post_id": 1_000_000, "dir": 1})
     assert response.status_code == 404
 
 
@@ -29,6 +39,31 @@ def test_vote_unauthorized(client, test_posts):
     assert response.status_code == 401
 
 
+def test_vote_rate_limited_per_user(authorized_client, test_posts, different_test_user, monkeypatch):
+    monkeypatch.setattr(settings, "RATE_LIMIT_VOTE", "1/minute")
+    assert authorized_client.post("/votes/", json={"post_id": test_posts[0].id, "dir": 1}).status_code == 201
+    response = authorized_client.post("/votes/", json={"post_id": test_posts[1].id, "dir": 1})
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "60"
+
+    # same address, other user
+    other = {"Authorization": f"Bearer {create_access_token({'user_id': different_test_user['id']})}"}
+    assert authorized_client.post("/votes/", json={"post_id": test_posts[1].id, "dir": 1}, headers=other).status_code == 201
+
+
+def test_bulk_votes_take_one_token_each(authorized_client, test_posts, monkeypatch):
+    monkeypatch.setattr(settings, "RATE_LIMIT_VOTE", "3/minute")
+    two = [{"post_id": post.id, "dir": 1} for post in test_posts[:2]]
+    res = authorized_client.post("/votes/bulk", json=two)
+    assert res.status_code == 200
+    assert res.headers["RateLimit-Remaining"] == "1"
+    assert authorized_client.post("/votes/bulk", json=two).status_code == 429
+    assert authorized_client.post("/votes/", json={"post_id": test_posts[2].id, "dir": 1}).status_code == 201
+    assert authorized_client.post("/votes/bulk", json=[{"post_id": test_posts[3].id, "dir": 1}]).status_code == 429
+    # larger than the bucket: no wait would let it through
+    assert authorized_client.post("/votes/bulk", json=two * 2).status_code == 413
+
+
 def test_delete_vote(authorized_client, test_posts, test_vote):
     response = authorized_client.post("/votes/", json={"post_id": test_posts[0].id, "dir": 0})
     assert response.status_code == 201
@@ -37,3 +72,189 @@ def test_delete_vote(authorized_client, test_posts, test_vote):
 def test_delete_vote_non_exist(authorized_client, test_posts):
     response = authorized_client.post("/votes/", json={"post_id": test_posts[0].id, "dir": 0})
     assert response.status_code == 404
+
+
+def test_vote_updates_vote_count(authorized_client, test_posts):
+    authorized_client.post("/votes/", json={"post_id": test_posts[0].id, "dir": 1})
+    assert authorized_client.get(f"/posts/{test_posts[0].id}").json()["votes"] == 1
+
+    authorized_client.post("/votes/", json={"post_id": test_posts[0].id, "dir": 0})
+    assert authorized_client.get(f"/posts/{test_posts[0].id}").json()["votes"] == 0
+
+
+def test_vote_is_one_statement(authorized_client, test_posts, count_queries):
+    with count_queries() as statements:
+        authorized_client.post("/votes/", json={"post_id": test_posts[0].id, "dir": 1})
+    assert len([statement for statement in statements if "votes" in statement]) == 1
+
+
+def test_apply_votes_in_order(test_posts, test_user, different_test_user, session):
+    post, missing = test_posts[0].id, 1_000_000
+    user, other = test_user["id"], different_test_user["id"]
+    votes = [VoteRequest(post, user, 1), VoteRequest(post, other, 1), VoteRequest(post, user, 1),
+             VoteRequest(post, user, 0), VoteRequest(post, user, 0), VoteRequest(missing, user, 1)]
+
+    async def apply(db):
+        results = await apply_votes(db, votes)
+        await db.commit()
+        return results
+
+    assert [result.status for result in session.run(apply)] == \
+        ["voted", "voted", "already_voted", "unvoted", "not_voted", "post_not_found"]
+    session.refresh(test_posts[0])
+    assert test_posts[0].vote_count == 1
+
+
+def test_vote_batcher_coalesces_concurrent_votes(test_posts, test_user, session):
+    batcher = VoteBatcher(max_size=3, max_delay=0.1)
+    votes = [VoteRequest(post.id, test_user["id"], 1) for post in test_posts[:3]] + \
+        [VoteRequest(test_posts[0].id, test_user["id"], 1)]
+
+    async def vote_concurrently(db):
+        # only the leader of a batch writes, with its own session: one session is enough
+        return await asyncio.gather(*(batcher.submit(db, vote) for vote in votes))
+
+    batches = REGISTRY.get_sample_value("vote_batch_size_count") or 0
+    results = session.run(vote_concurrently)
+    assert [result.status for result in results] == ["voted", "voted", "voted", "already_voted"]
+    # a full batch of three, then the leftover vote alone
+    assert REGISTRY.get_sample_value("vote_batch_size_count") - batches == 2
+
+
+@pytest.mark.parametrize("cancelled", [1, 0])
+def test_vote_batcher_survives_cancelled_requests(monkeypatch, cancelled):
+    """A client that goes away mid-batch, follower (1) or leader (0), must not strand the others."""
+    committed = []
+
+    class StubSession:
+        async def commit(self):
+            committed.append(True)
+
+    async def stub_apply_votes(db, votes):
+        await asyncio.sleep(0.01)
+        return [VoteResult(*vote, "voted", 1) for vote in votes]
+    monkeypatch.setattr(voting, "apply_votes", stub_apply_votes)
+    batcher = VoteBatcher(max_size=10, max_delay=0.05)
+
+    async def scenario():
+        tasks = [asyncio.create_task(batcher.submit(StubSession(), VoteRequest(id, 1, 1))) for id in range(3)]
+        await asyncio.sleep(0.01)
+        tasks[cancelled].cancel()
+        return await asyncio.wait_for(asyncio.gather(*tasks, return_exceptions=True), 1)
+
+    results = asyncio.run(scenario())
+    assert isinstance(results[cancelled], asyncio.CancelledError)
+    assert [result.post_id for index, result in enumerate(results) if index != cancelled] == \
+        [id for id in range(3) if id != cancelled]
+    assert committed == [True]
+
+
+def test_vote_batching_endpoint(authorized_client, test_posts, monkeypatch):
+    monkeypatch.setattr(settings, "VOTE_BATCHING", True)
+    assert authorized_client.post("/votes/", json={"post_id": test_posts[0].id, "dir": 1}).status_code == 201
+    assert authorized_client.post("/votes/", json={"post_id": test_posts[0].id, "dir": 1}).status_code == 409
+    assert authorized_client.get(f"/posts/{test_posts[0].id}").json()["votes"] == 1
+
+
+def test_bulk_votes(authorized_client, test_posts):
+    votes = [{"post_id": test_posts[0].id, "dir": 1}, {"post_id": test_posts[1].id, "dir": 1},
+             {"post_id": test_posts[0].id, "dir": 1}, {"post_id": test_posts[1].id, "dir": 0},
+             {"post_id": 1_000_000, "dir": 1}]
+    res = authorized_client.post("/votes/bulk", json=votes)
+    assert res.status_code == 200
+    assert [item["status"] for item in res.json()] == ["voted", "voted", "already_voted", "unvoted", "post_not_found"]
+    assert authorized_client.get(f"/posts/{test_posts[0].id}").json()["votes"] == 1
+    assert authorized_client.get(f"/posts/{test_posts[1].id}").json()["votes"] == 0
+
+
+def test_reconcile_vote_counts(test_posts, test_vote, session):
+    test_posts[0].vote_count = 0
+    test_posts[1].vote_count = 7
+    session.commit()
+
+    assert sorted(session.run(reconcile_vote_counts)) == sorted([test_posts[0].id, test_posts[1].id])
+    for post in test_posts:
+        session.refresh(post)
+    assert [post.vote_count for post in test_posts] == [1, 0, 0, 0]
+
+
+def test_live_updates_over_websocket(authorized_client, test_posts, token):
+    post_id = test_posts[0].id
+    with authorized_client.websocket_connect(f"/live/ws?token={token}&post_ids={post_id}") as ws:
+        ws.send_json({"subscribe": [test_posts[1].id]})
+        assert ws.receive_json() == {"post_ids": sorted([post_id, test_posts[1].id])}
+
+        authorized_client.post("/votes/", json={"post_id": post_id, "dir": 1})
+        assert ws.receive_json() == {"updates": [{"post_id": post_id, "delta": 1, "vote_count": 1}]}
+
+        ws.send_json({"unsubscribe": [post_id]})
+        assert ws.receive_json() == {"post_ids": [test_posts[1].id]}
+        authorized_client.post("/votes/", json={"post_id": post_id, "dir": 0})
+        authorized_client.post("/votes/bulk", json=[{"post_id": test_posts[1].id, "dir": 1}])
+        assert ws.receive_json() == {"updates": [{"post_id": test_posts[1].id, "delta": 1, "vote_count": 1}]}
+
+
+def test_live_websocket_needs_a_token(client, test_posts):
+    with pytest.raises(WebSocketDisconnect) as disconnected:
+        with client.websocket_connect(f"/live/ws?post_ids={test_posts[0].id}") as ws:
+            ws.receive_json()
+    assert disconnected.value.code == 1008
+
+
+def test_live_sse_events(client, token):
+    assert client.get("/live/posts?post_ids=1").status_code == 401
+
+    async def stream():
+        subscription = hub.open()
+        hub.subscribe(subscription, [1])
+        events = sse_events(subscription, heartbeat=0.01)
+        received = [await events.__anext__(), await events.__anext__()]
+        hub.publish(1, 1, 5)
+        received.append(await events.__anext__())
+        await events.aclose()
+        return received
+
+    assert asyncio.run(stream()) == [
+        "retry: 3000\n\n",
+        ": heartbeat\n\n",
+        'event: vote_count\ndata: {"post_id":1,"delta":1,"vote_count":5}\n\n',
+    ]
+
+
+def test_live_updates_merge_and_drop_for_slow_consumers():
+    async def slow_consumer():
+        live = LiveHub(LocalPubSubBackend(), queue_size=2)
+        subscription = live.open()
+        live.subscribe(subscription, [1, 2, 3])
+        live.publish(1, 1, 1)
+        live.publish(2, 1, 1)
+        live.publish(1, 1, 2)
+        live.publish(1, -1, 1)
+        merged = await subscription.next()
+        live.publish(1, 1, 2)
+        live.publish(2, 1, 2)
+        live.publish(3, 1, 1)
+        trimmed = await subscription.next()
+        live.close(subscription)
+        return merged, trimmed, subscription.dropped
+
+    merged, trimmed, dropped = asyncio.run(slow_consumer())
+    assert merged == [{"post_id": 1, "delta": 1, "vote_count": 1}, {"post_id": 2, "delta": 1, "vote_count": 1}]
+    # the oldest post is dropped once two are pending
+    assert trimmed == [{"post_id": 2, "delta": 1, "vote_count": 2}, {"post_id": 3, "delta": 1, "vote_count": 1}]
+    assert dropped == 1
+
+
+def test_live_updates_reach_other_workers():
+    backend = LocalPubSubBackend()
+    workers = [LiveHub(backend), LiveHub(backend)]
+
+    async def publish_on_one_worker():
+        subscription = workers[1].open()
+        workers[1].subscribe(subscription, [1])
+        workers[0].publish(1, 1, 3)
+        updates = await subscription.next(timeout=1)
+        workers[1].close(subscription)
+        return updates
+
+    assert asyncio.run(publish_on_one_worker()) == [{"post_id": 1, "delta": 1, "vote_count": 3}]